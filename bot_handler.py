@@ -2,28 +2,87 @@
 Telegram User Client 消息处理模块 (Telethon版本)
 """
 
+import asyncio
+import html
+import io
 import logging
-from typing import List, Optional
-from pathlib import Path
+import re
+from collections import OrderedDict
+from typing import List, Optional, Union
 
-from telethon import TelegramClient
+from telethon import TelegramClient, utils
 from telethon.tl.types import Message, MessageMediaPhoto, MessageMediaDocument
-from telethon.errors import RPCError
+from telethon.errors import FloodWaitError, RPCError
 
 from config import Config
+from parallel_transfer import BIG_FILE_THRESHOLD, fast_upload
+from rate_limiter import RateLimiter
 
 logger = logging.getLogger(__name__)
 
+# 文本中可能包含 HTML 标签或实体的标志字符
+_HTML_SENTINEL = re.compile(r'[<&]')
+
+
+def _parse_mode_for(text: Union[str, List[str], None]) -> Optional[str]:
+    """文本包含 HTML 时使用 html 解析，否则不解析"""
+    if isinstance(text, list):
+        text = ''.join(t for t in text if t)
+    return 'html' if text and _HTML_SENTINEL.search(text) else None
+
 
 class TelegramBotHandler:
     """Telegram User Client 消息处理器 (使用 Telethon)"""
     
+    __slots__ = (
+        'config', '_upload_semaphore', '_rate_limiter', '_uploaded_media_cache',
+        '_pending_album', '_album_flush_handle', '_album_flush_tasks', '_album_closing', '_target_entity',
+    )
+    
+    # MIME 前缀 -> 媒体类型 (按顺序匹配)
+    _MIME_PREFIX_TYPES = (
+        ('image/', 'photo'),
+        ('video/', 'video'),
+        ('audio/', 'audio'),
+    )
+    
+    # 已上传媒体缓存的最大条目数
+    _UPLOADED_MEDIA_CACHE_SIZE = 1000
+    
+    # 可合并为相册发送的媒体类型，以及单个相册最多包含的文件数
+    # 每条等待合并的消息会占用一个转发协程直到相册发送完成，转发协程数需不少于 ALBUM_MAX_SIZE 才能凑满相册
+    _ALBUM_MEDIA_TYPES = ('photo', 'video')
+    ALBUM_MAX_SIZE = 10
+    
+    # 媒体类型 -> send_file 额外参数
+    _SEND_FILE_KWARGS = {
+        'photo': {},
+        'video': {'supports_streaming': True},  # 支持流媒体
+        'animation': {'supports_streaming': True},
+        'audio': {'voice_note': False},  # 作为音频文件而不是语音消息
+    }
+    
     def __init__(self, config: Config):
         self.config = config
+        # 限制逐个发送时的并发上传数量，避免触发频率限制
+        self._upload_semaphore = asyncio.Semaphore(config.max_parallel_uploads)
+        # 全局 + 目标频道发送速率限制
+        self._rate_limiter = RateLimiter(config.send_rate_global, config.send_rate_per_chat)
+        # 已上传媒体缓存 {source_key: 目标频道中的媒体对象}，再次转发时跳过上传
+        self._uploaded_media_cache = OrderedDict()
+        # 待合并发送的单个媒体 [(file_info, caption, future)]
+        self._pending_album = []
+        self._album_flush_handle: Optional[asyncio.TimerHandle] = None
+        # 进行中的相册发送任务，退出前等待全部完成
+        self._album_flush_tasks = set()
+        # 退出时置位，之后加入的媒体不再等待合并窗口
+        self._album_closing = False
+        # 启动时解析的目标频道实体，避免每次发送都重新解析
+        self._target_entity = None
     
     def has_media(self, message: Message) -> bool:
         """检查消息是否包含媒体文件"""
-        return message.media is not None and not isinstance(message.media, type(None))
+        return message.media is not None
     
     def get_media_type(self, message: Message) -> Optional[str]:
         """获取媒体类型"""
@@ -36,13 +95,13 @@ class TelegramBotHandler:
             document = message.media.document
             if document and document.mime_type:
                 mime_type = document.mime_type
-                if mime_type.startswith('image/'):
-                    return 'photo'
-                elif mime_type.startswith('video/'):
-                    return 'video'
-                elif mime_type.startswith('audio/'):
-                    return 'audio'
-                elif 'gif' in mime_type.lower():
+                media_type = next(
+                    (t for prefix, t in self._MIME_PREFIX_TYPES if mime_type.startswith(prefix)),
+                    None
+                )
+                if media_type:
+                    return media_type
+                if 'gif' in mime_type.lower():
                     return 'animation'
             return 'document'
         
@@ -58,143 +117,291 @@ class TelegramBotHandler:
                 forward_text = "📝 转发的消息"  # 如果没有文本内容，添加默认提示
             
             # 发送到目标频道
-            await client.send_message(
-                entity=self.config.target_channel_id,
-                message=forward_text,
-                parse_mode='html'
-            )
+            async with self._rate_limiter.acquire(self.config.target_channel_id):
+                await client.send_message(
+                    entity=self._get_target_entity(),
+                    message=forward_text,
+                    parse_mode=_parse_mode_for(forward_text)
+                )
             
-            logger.info(f"成功转发文本消息到目标频道")
+            logger.info("成功转发文本消息到目标频道")
             
         except RPCError as e:
-            logger.error(f"转发文本消息失败: {e}")
+            logger.error("转发文本消息失败: %s", e)
             raise
     
     async def forward_message(self, message: Message, downloaded_files: List[dict], client: TelegramClient):
-        """发送包含媒体的消息（作为原创内容）"""
+        """发送包含媒体的消息（作为原创内容）
+        
+        发送成功的文件在信息中标记 sent，失败后重试同一批文件时只发送尚未发出的文件。
+        """
         try:
             # 构建消息文本
             forward_text = self._build_forward_text(message)
             
             # 根据媒体数量选择发送方式
-            if len(downloaded_files) == 1:
+            if self._can_batch_into_album(downloaded_files):
+                # 短时间内的多条单图/单视频消息合并为一个相册发送
+                await self._enqueue_for_album(downloaded_files[0], forward_text, client)
+            elif len(downloaded_files) == 1:
                 # 单个媒体文件
                 await self._send_single_media(message, downloaded_files[0], forward_text, client)
             else:
                 # 多个媒体文件 - 发送为媒体组
                 await self._send_media_group(message, downloaded_files, forward_text, client)
             
-            logger.info(f"成功转发媒体消息到目标频道")
+            logger.info("成功转发媒体消息到目标频道")
             
         except RPCError as e:
-            logger.error(f"转发媒体消息失败: {e}")
+            logger.error("转发媒体消息失败: %s", e)
             raise
     
     async def _send_single_media(self, message: Message, file_info: dict, caption: str, client: TelegramClient):
-        """发送单个媒体文件"""
-        file_path = file_info['path']
+        """发送单个媒体文件，已发送过的文件（重试时）直接跳过"""
+        if file_info.get('sent'):
+            return
+        file_path = file_info['path'] or file_info.get('file_name')
         media_type = file_info['type']
         
         try:
-            # 根据媒体类型发送
-            if media_type == 'photo':
-                await client.send_file(
-                    entity=self.config.target_channel_id,
-                    file=str(file_path),
-                    caption=caption,
-                    parse_mode='html'
-                )
-            elif media_type in ['video', 'animation']:
-                # 视频和动画
-                await client.send_file(
-                    entity=self.config.target_channel_id,
-                    file=str(file_path),
-                    caption=caption,
-                    parse_mode='html',
-                    supports_streaming=True  # 支持流媒体
-                )
-            elif media_type == 'audio':
-                # 音频
-                await client.send_file(
-                    entity=self.config.target_channel_id,
-                    file=str(file_path),
-                    caption=caption,
-                    parse_mode='html',
-                    voice_note=False  # 作为音频文件而不是语音消息
-                )
-            else:
-                # 其他文档类型
-                await client.send_file(
-                    entity=self.config.target_channel_id,
-                    file=str(file_path),
+            # 根据媒体类型选择额外的发送参数，其他文档类型无额外参数
+            extra_kwargs = self._SEND_FILE_KWARGS.get(media_type, {})
+            upload_source = self._get_upload_source(file_info)
+            
+            # 大文件并行分片上传
+            if (self.config.parallel_upload_enabled
+                    and isinstance(upload_source, str)
+                    and file_info.get('size', 0) > BIG_FILE_THRESHOLD):
+                # 预先从本地文件解析属性（如视频时长），上传后的句柄无法再读取
+                attributes, _ = utils.get_attributes(upload_source, **extra_kwargs)
+                upload_source = await fast_upload(client, upload_source, workers=self.config.upload_workers)
+                extra_kwargs = {**extra_kwargs, 'attributes': attributes}
+            
+            async with self._rate_limiter.acquire(self.config.target_channel_id):
+                sent = await client.send_file(
+                    entity=self._get_target_entity(),
+                    file=upload_source,
                     caption=caption,
-                    parse_mode='html'
+                    parse_mode=_parse_mode_for(caption),
+                    **extra_kwargs
                 )
+            file_info['sent'] = True
+            self._remember_uploaded_media(file_info, sent)
                 
         except Exception as e:
-            logger.error(f"发送单个媒体文件失败: {file_path}, 错误: {e}")
+            logger.error("发送单个媒体文件失败: %s, 错误: %s", file_path, e)
             raise
     
-    async def _send_media_group(self, message: Message, file_infos: List[dict], caption: str, client: TelegramClient):
-        """发送媒体组"""
+    def _can_batch_into_album(self, downloaded_files: List[dict]) -> bool:
+        """检查消息是否可以与其他消息合并为相册发送"""
+        return (self.config.album_batch_enabled
+                and len(downloaded_files) == 1
+                and downloaded_files[0]['type'] in self._ALBUM_MEDIA_TYPES)
+    
+    async def _enqueue_for_album(self, file_info: dict, caption: str, client: TelegramClient):
+        """加入待合并相册，等待相册发送完成后返回"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending_album.append((file_info, caption, future))
+        
+        if len(self._pending_album) % self.ALBUM_MAX_SIZE == 0:
+            # 凑满一个相册，立即发送（发送任务启动前继续加入的媒体等待下一个相册）
+            self._schedule_album_flush(client)
+        elif self._album_flush_handle is None:
+            self._album_flush_handle = loop.call_later(
+                self._album_flush_delay(), self._schedule_album_flush, client
+            )
+        
+        await future
+    
+    def _schedule_album_flush(self, client: TelegramClient):
+        """启动相册发送任务"""
+        if self._album_flush_handle is not None:
+            self._album_flush_handle.cancel()
+            self._album_flush_handle = None
+        task = asyncio.create_task(self._flush_album(client))
+        self._album_flush_tasks.add(task)
+        task.add_done_callback(self._album_flush_tasks.discard)
+    
+    def _album_flush_delay(self) -> float:
+        """相册合并等待时间，退出时不再等待"""
+        return 0 if self._album_closing else self.config.album_batch_window
+    
+    async def flush_albums(self, client: TelegramClient):
+        """立即发送所有待合并的媒体并等待发送完成（退出时调用）"""
+        self._album_closing = True
+        if self._pending_album:
+            self._schedule_album_flush(client)
+        while self._album_flush_tasks:
+            await asyncio.gather(*self._album_flush_tasks, return_exceptions=True)
+    
+    async def _flush_album(self, client: TelegramClient):
+        """发送待合并的媒体"""
+        batch = self._pending_album[:self.ALBUM_MAX_SIZE]
+        self._pending_album = self._pending_album[self.ALBUM_MAX_SIZE:]
+        if not batch:
+            return
+        
+        file_infos = [file_info for file_info, _, _ in batch]
+        captions = [caption for _, caption, _ in batch]
+        
+        error = None
+        try:
+            if len(batch) == 1:
+                await self._send_single_media(None, file_infos[0], captions[0], client)
+            else:
+                logger.info("合并 %s 条消息为相册发送", len(batch))
+                await self._send_media_group(None, file_infos, captions, client)
+        except Exception as e:
+            error = e
+        finally:
+            # 按每个文件的发送结果通知等待方，已发出的消息不会被当作失败重发；
+            # 发送任务被取消时未发出的消息同样以失败结束，等待方不会一直挂起
+            for file_info, _, future in batch:
+                if future.done():
+                    continue
+                if file_info.get('sent'):
+                    future.set_result(None)
+                else:
+                    future.set_exception(error or RuntimeError("相册发送已取消"))
+        
+        # 剩余的媒体继续等待下一个窗口
+        if self._pending_album and self._album_flush_handle is None:
+            self._album_flush_handle = asyncio.get_running_loop().call_later(
+                self._album_flush_delay(), self._schedule_album_flush, client
+            )
+    
+    async def _send_media_group(self, message: Message, file_infos: List[dict], caption: Union[str, List[str]], client: TelegramClient):
+        """发送媒体组，caption 可以是整组说明或每个文件的说明列表"""
+        if isinstance(caption, list):
+            captions = caption
+        else:
+            # 只在第一个文件上添加说明文字
+            captions = [caption] + [""] * (len(file_infos) - 1)
+        
+        # 重试时跳过已发送的文件，已发出的相册不会重复发送
+        pending = [(file_info, file_caption) for file_info, file_caption in zip(file_infos, captions) if not file_info.get('sent')]
+        
+        # 单个相册最多 10 个文件，每个相册单独限速发送，失败时只回退该相册
+        for start in range(0, len(pending), self.ALBUM_MAX_SIZE):
+            chunk = pending[start:start + self.ALBUM_MAX_SIZE]
+            await self._send_album_chunk(
+                message, [file_info for file_info, _ in chunk], [file_caption for _, file_caption in chunk], client
+            )
+    
+    async def _send_album_chunk(self, message: Message, file_infos: List[dict], captions: List[str], client: TelegramClient):
+        """将不超过 10 个文件作为一个相册发送（一次 SendMultiMedia 请求）"""
         try:
             # 准备文件列表
-            files = []
-            for file_info in file_infos:
-                files.append(str(file_info['path']))
+            files = [self._get_upload_source(file_info) for file_info in file_infos]
             
             # Telethon 的 send_file 可以接受文件列表，自动作为媒体组发送
-            await client.send_file(
-                entity=self.config.target_channel_id,
-                file=files,
-                caption=caption,
-                parse_mode='html'
-            )
+            async with self._rate_limiter.acquire(self.config.target_channel_id):
+                sent_messages = await client.send_file(
+                    entity=self._get_target_entity(),
+                    file=files,
+                    caption=captions,
+                    parse_mode=_parse_mode_for(captions)
+                )
+            for file_info in file_infos:
+                file_info['sent'] = True
+            if isinstance(sent_messages, list) and len(sent_messages) == len(file_infos):
+                for file_info, sent in zip(file_infos, sent_messages):
+                    self._remember_uploaded_media(file_info, sent)
             
-            logger.info(f"成功发送媒体组，包含 {len(files)} 个文件")
+            logger.info("成功发送媒体组，包含 %s 个文件", len(files))
             
+        except FloodWaitError:
+            # 频率限制时逐个发送只会发出更多请求，交给调用方暂停所有转发后重试
+            raise
         except Exception as e:
-            logger.error(f"发送媒体组失败: {e}")
-            # 如果媒体组发送失败，尝试逐个发送
+            logger.error("发送媒体组失败: %s", e)
+            # 如果媒体组发送失败，尝试并发逐个发送
             logger.info("尝试逐个发送媒体文件...")
-            for i, file_info in enumerate(file_infos):
-                try:
-                    # 只在第一个文件上添加说明文字
-                    file_caption = caption if i == 0 else ""
-                    await self._send_single_media(message, file_info, file_caption, client)
-                    logger.info(f"成功发送第 {i+1}/{len(file_infos)} 个文件")
-                except Exception as single_error:
-                    logger.error(f"发送第 {i+1} 个文件失败: {single_error}")
+            results = await asyncio.gather(
+                *(
+                    self._send_single_media_limited(message, file_info, file_caption, client)
+                    for file_info, file_caption in zip(file_infos, captions)
+                ),
+                return_exceptions=True
+            )
+            errors = []
+            for i, result in enumerate(results):
+                if isinstance(result, Exception):
+                    logger.error("发送第 %s 个文件失败: %s", i + 1, result)
+                    errors.append(result)
+                else:
+                    logger.info("成功发送第 %s/%s 个文件", i + 1, len(file_infos))
+            # 有文件发送失败时抛出（优先抛出 FloodWait，让调用方暂停转发）；
+            # 成功的文件已标记为已发送，调用方重试时只发送失败的文件
+            if errors:
+                raise next((error for error in errors if isinstance(error, FloodWaitError)), errors[0])
     
-    def _build_forward_text(self, message: Message) -> str:
-        """构建消息文本（不显示转发信息）"""
-        text_parts = []
+    async def _send_single_media_limited(self, message: Message, file_info: dict, caption: str, client: TelegramClient):
+        """在并发上传限制内发送单个媒体文件"""
+        async with self._upload_semaphore:
+            await self._send_single_media(message, file_info, caption, client)
+    
+    def get_uploaded_media(self, source_key: str):
+        """查询源消息对应的已上传媒体，没有时返回 None"""
+        media = self._uploaded_media_cache.get(source_key)
+        if media is not None:
+            self._uploaded_media_cache.move_to_end(source_key)
+        return media
+    
+    def _get_upload_source(self, file_info: dict):
+        """获取发送用的文件：已上传过的媒体直接复用，内存中的文件包装为 BytesIO，否则使用本地路径"""
+        # 下载前已命中缓存的文件直接带有媒体对象，不受之后缓存淘汰影响
+        media = file_info.get('media')
+        if media is not None:
+            return media
         
-        # 添加原始消息文本
-        if message.text:
-            text_parts.append(message.text)
+        source_key = file_info.get('source_key')
+        if source_key and source_key in self._uploaded_media_cache:
+            logger.debug("复用已上传的媒体: %s", source_key)
+            return self._uploaded_media_cache[source_key]
         
-        # 不再添加转发信息，让消息看起来像原创内容
+        data = file_info.get('data')
+        if data is not None:
+            # Telethon 根据 name 推断文件类型和属性
+            buffer = io.BytesIO(data)
+            buffer.name = file_info['file_name']
+            return buffer
+        return str(file_info['path'])
+    
+    def _remember_uploaded_media(self, file_info: dict, sent_message):
+        """记录已上传的媒体，供相同源消息再次转发时复用"""
+        source_key = file_info.get('source_key')
+        media = getattr(sent_message, 'media', None)
+        if not source_key or media is None:
+            return
         
-        return '\n'.join(text_parts) if text_parts else ""
+        self._uploaded_media_cache[source_key] = media
+        self._uploaded_media_cache.move_to_end(source_key)
+        if len(self._uploaded_media_cache) > self._UPLOADED_MEDIA_CACHE_SIZE:
+            self._uploaded_media_cache.popitem(last=False)
+    
+    def _build_forward_text(self, message: Message) -> str:
+        """构建消息文本（不显示转发信息）"""
+        # 只使用原始消息文本，不再添加转发信息，让消息看起来像原创内容
+        return message.text or ""
     
     def _escape_html(self, text: str) -> str:
         """转义HTML特殊字符"""
         if not text:
             return ""
         
-        escape_chars = {
-            '&': '&amp;',
-            '<': '&lt;',
-            '>': '&gt;',
-            '"': '&quot;',
-            "'": '&#x27;'
-        }
+        # 无需转义时直接返回原字符串
+        if not any(c in text for c in '&<>"\''):
+            return text
         
-        for char, escaped in escape_chars.items():
-            text = text.replace(char, escaped)
-        
-        return text
+        return html.escape(text, quote=True)
+    
+    def _get_target_entity(self):
+        """获取目标频道实体，未解析时回退到配置的频道ID"""
+        if self._target_entity is not None:
+            return self._target_entity
+        return self.config.target_channel_id
     
     async def get_channel_info(self, client: TelegramClient, channel_id: str):
         """获取频道信息"""
@@ -207,7 +414,7 @@ class TelegramBotHandler:
                 'type': 'channel' if hasattr(entity, 'broadcast') else 'group'
             }
         except Exception as e:
-            logger.error(f"获取频道信息失败 {channel_id}: {e}")
+            logger.error("获取频道信息失败 %s: %s", channel_id, e)
             return None
     
     async def check_permissions(self, client: TelegramClient):
@@ -223,11 +430,14 @@ class TelegramBotHandler:
             if not target_info:
                 raise ValueError(f"无法访问目标频道: {self.config.target_channel_id}")
             
-            logger.info(f"源频道: {source_info['title']} (ID: {source_info['id']})")
-            logger.info(f"目标频道: {target_info['title']} (ID: {target_info['id']})")
+            # 缓存目标频道实体，后续发送直接使用
+            self._target_entity = await client.get_input_entity(self.config.target_channel_id)
+            
+            logger.info("源频道: %s (ID: %s)", source_info['title'], source_info['id'])
+            logger.info("目标频道: %s (ID: %s)", target_info['title'], target_info['id'])
             
             return True
             
         except Exception as e:
-            logger.error(f"检查频道权限失败: {e}")
+            logger.error("检查频道权限失败: %s", e)
             return False
\ No newline at end of file
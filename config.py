@@ -3,84 +3,167 @@
 """
 
 import os
+import re
 from pathlib import Path
 from typing import Optional
 
+# 导入socks模块来获取代理类型常量 (可选依赖)
+try:
+    import socks
+    _SOCKS_TYPES = {
+        'socks5': socks.SOCKS5,
+        'socks4': socks.SOCKS4,
+        'http': socks.HTTP
+    }
+except ImportError:
+    _SOCKS_TYPES = None
+
+# 频道ID: @username 或数字ID（可带负号）
+_CHANNEL_ID_RE = re.compile(r'^(@\w+|-?\d+)$')
+
+# 文件大小字符串，如 "2GB"、"500 MB"、"1024"
+_SIZE_RE = re.compile(r'^(\d+)\s*([KMG]?B)?$', re.IGNORECASE)
+_TRUE_VALUES = {'true', '1', 'yes'}
+_SIZE_MULTIPLIERS = {'': 1, 'B': 1, 'KB': 1 << 10, 'MB': 1 << 20, 'GB': 1 << 30}
+
 
 class Config:
     """配置类"""
     
+    # 新增配置项时需要同步添加到这里
+    __slots__ = (
+        # User API
+        'api_id', 'api_hash', 'phone_number',
+        # 频道
+        'source_channel_id', 'target_channel_id', 'source_channels',
+        # 命令权限
+        'admin_user_ids',
+        # 会话
+        'session_name', 'session_path',
+        # 下载 / 上传
+        'download_path', 'download_dir', 'max_file_size', 'in_memory_download_limit', 'in_memory_total_limit',
+        'max_parallel_uploads', 'parallel_upload_enabled', 'upload_workers',
+        'album_batch_enabled', 'album_batch_window', 'forward_concurrency', 'msg_cache_size',
+        'max_batch', 'max_concurrent_messages',
+        'send_rate_global', 'send_rate_per_chat', 'flood_sleep_threshold', 'forwards_per_minute',
+        # 随机延迟
+        'random_delay_min', 'random_delay_max', 'batch_delay_min', 'batch_delay_max',
+        # 消息队列
+        'queue_enabled', 'min_send_delay', 'max_send_delay', 'queue_check_interval', 'max_queue_size',
+        'batch_send_enabled', 'batch_size', 'batch_interval',
+        'queue_save_path', 'auto_save_queue',
+        # 代理
+        'proxy_enabled', 'proxy_type', 'proxy_host', 'proxy_port',
+        'proxy_username', 'proxy_password', 'proxy_rdns',
+        'proxy_rotation_enabled', 'proxy_rotation_interval', 'proxy_list_file',
+        'proxy_test_enabled', 'proxy_test_timeout',
+        '_proxy_config_cache',
+    )
+    
     def __init__(self):
+        # 环境变量快照，避免逐个调用 os.getenv
+        env = dict(os.environ)
+        
         # User API 配置 (必需)
-        self.api_id = self._get_required_env('API_ID', int)
-        self.api_hash = self._get_required_env('API_HASH')
-        self.phone_number = self._get_required_env('PHONE_NUMBER')
+        self.api_id = self._get_required_env(env, 'API_ID', int)
+        self.api_hash = self._get_required_env(env, 'API_HASH')
+        self.phone_number = self._get_required_env(env, 'PHONE_NUMBER')
         
         # 频道配置
-        self.source_channel_id = self._get_required_env('SOURCE_CHANNEL_ID')
-        self.target_channel_id = self._get_required_env('TARGET_CHANNEL_ID')
+        self.source_channel_id = self._get_required_env(env, 'SOURCE_CHANNEL_ID')
+        self.target_channel_id = self._get_required_env(env, 'TARGET_CHANNEL_ID')
         
         # 多源频道配置 (可选)
-        source_channels_str = os.getenv('SOURCE_CHANNELS', '')
+        source_channels_str = env.get('SOURCE_CHANNELS', '')
         if source_channels_str:
             self.source_channels = [ch.strip() for ch in source_channels_str.split(',') if ch.strip()]
         else:
             self.source_channels = [self.source_channel_id]  # 默认使用单个源频道
         
+        # 命令权限设置：除本账号（收藏夹）外，允许发送私聊命令的用户数字ID
+        admin_user_ids_str = env.get('ADMIN_USER_IDS', '')
+        try:
+            self.admin_user_ids = frozenset(int(uid) for uid in admin_user_ids_str.split(',') if uid.strip())
+        except ValueError:
+            raise ValueError(f"ADMIN_USER_IDS 必须为逗号分隔的数字用户ID: {admin_user_ids_str}") from None
+        
         # 会话设置
-        self.session_name = os.getenv('SESSION_NAME', 'telegram_session')
-        self.session_path = Path(os.getenv('SESSION_PATH', './'))
+        self.session_name = env.get('SESSION_NAME', 'telegram_session')
+        self.session_path = Path(env.get('SESSION_PATH', './'))
         
         # 下载设置
-        self.download_path = os.getenv('DOWNLOAD_PATH', './downloads')
-        self.max_file_size = self._parse_file_size(os.getenv('MAX_FILE_SIZE', '2GB'))  # User API 支持 2GB
+        self.download_path = env.get('DOWNLOAD_PATH', './downloads')
+        self.download_dir = Path(self.download_path).resolve()  # 解析后的下载目录，启动时创建一次
+        self.max_file_size = self._parse_file_size(env.get('MAX_FILE_SIZE', '2GB'))  # User API 支持 2GB
+        self.in_memory_download_limit = self._parse_file_size(env.get('IN_MEMORY_DOWNLOAD_LIMIT', '10MB'))  # 不超过此大小的文件直接下载到内存，0 表示禁用
+        self.in_memory_total_limit = self._parse_file_size(env.get('IN_MEMORY_TOTAL_LIMIT', '256MB'))  # 内存中文件的合计上限，超出时下载到磁盘
+        
+        # 上传设置
+        self.max_parallel_uploads = self._get_int_env(env, 'MAX_PARALLEL_UPLOADS', 3)  # 并发上传数量
+        self.parallel_upload_enabled = self._get_bool_env(env, 'PARALLEL_UPLOAD_ENABLED', False)  # 大文件并行分片上传
+        self.upload_workers = self._get_int_env(env, 'UPLOAD_WORKERS', 4)  # 并行分片上传的连接数（每个连接独立上传分片）
+        self.album_batch_enabled = self._get_bool_env(env, 'ALBUM_BATCH_ENABLED', False)  # 合并单个媒体为相册发送
+        self.album_batch_window = self._get_int_env(env, 'ALBUM_BATCH_WINDOW', 5)  # 相册合并等待时间（秒）
+        self.forward_concurrency = self._get_int_env(env, 'FORWARD_CONCURRENCY', 4)  # 批量下载转发的并发消息数
+        self.msg_cache_size = self._get_int_env(env, 'MSG_CACHE_SIZE', 2000)  # 最近消息缓存条数
+        self.max_batch = self._get_int_env(env, 'MAX_BATCH', 100)  # 单条下载命令最多处理的消息数
+        self.max_concurrent_messages = self._get_int_env(env, 'MAX_CONCURRENT_MESSAGES', 3)  # 同时处理的新消息数
+        
+        # 发送速率限制 (每秒)
+        self.send_rate_global = self._get_int_env(env, 'SEND_RATE_GLOBAL', 30)  # 全局每秒最大发送数
+        self.send_rate_per_chat = self._get_int_env(env, 'SEND_RATE_PER_CHAT', 1)  # 单个频道每秒最大发送数
+        self.flood_sleep_threshold = self._get_int_env(env, 'FLOOD_SLEEP_THRESHOLD', 120)  # 自动等待的最长 FloodWait（秒）
+        self.forwards_per_minute = self._get_int_env(env, 'FORWARDS_PER_MINUTE', 30)  # 每分钟最多转发的消息数
         
         # 随机延迟设置
-        self.random_delay_min = int(os.getenv('RANDOM_DELAY_MIN', '2'))
-        self.random_delay_max = int(os.getenv('RANDOM_DELAY_MAX', '15'))
-        self.batch_delay_min = int(os.getenv('BATCH_DELAY_MIN', '30'))
-        self.batch_delay_max = int(os.getenv('BATCH_DELAY_MAX', '120'))
+        self.random_delay_min = self._get_int_env(env, 'RANDOM_DELAY_MIN', 2)
+        self.random_delay_max = self._get_int_env(env, 'RANDOM_DELAY_MAX', 15)
+        self.batch_delay_min = self._get_int_env(env, 'BATCH_DELAY_MIN', 30)
+        self.batch_delay_max = self._get_int_env(env, 'BATCH_DELAY_MAX', 120)
         
         # 消息队列设置
-        self.queue_enabled = os.getenv('QUEUE_ENABLED', 'false').lower() == 'true'
-        self.min_send_delay = int(os.getenv('MIN_SEND_DELAY', '300'))  # 5分钟
-        self.max_send_delay = int(os.getenv('MAX_SEND_DELAY', '7200'))  # 2小时
-        self.queue_check_interval = int(os.getenv('QUEUE_CHECK_INTERVAL', '30'))  # 30秒
-        self.max_queue_size = int(os.getenv('MAX_QUEUE_SIZE', '100'))
+        self.queue_enabled = self._get_bool_env(env, 'QUEUE_ENABLED', False)
+        self.min_send_delay = self._get_int_env(env, 'MIN_SEND_DELAY', 300)  # 5分钟
+        self.max_send_delay = self._get_int_env(env, 'MAX_SEND_DELAY', 7200)  # 2小时
+        self.queue_check_interval = self._get_int_env(env, 'QUEUE_CHECK_INTERVAL', 30)  # 30秒
+        self.max_queue_size = self._get_int_env(env, 'MAX_QUEUE_SIZE', 100)
         
         # 分批发送设置
-        self.batch_send_enabled = os.getenv('BATCH_SEND_ENABLED', 'false').lower() == 'true'
-        self.batch_size = int(os.getenv('BATCH_SIZE', '5'))
-        self.batch_interval = int(os.getenv('BATCH_INTERVAL', '1800'))  # 30分钟
+        self.batch_send_enabled = self._get_bool_env(env, 'BATCH_SEND_ENABLED', False)
+        self.batch_size = self._get_int_env(env, 'BATCH_SIZE', 5)
+        self.batch_interval = self._get_int_env(env, 'BATCH_INTERVAL', 1800)  # 30分钟
         
         # 队列持久化设置
-        self.queue_save_path = os.getenv('QUEUE_SAVE_PATH', './queue_data.json')
-        self.auto_save_queue = os.getenv('AUTO_SAVE_QUEUE', 'true').lower() == 'true'
+        self.queue_save_path = env.get('QUEUE_SAVE_PATH', './queue_data.json')
+        self.auto_save_queue = self._get_bool_env(env, 'AUTO_SAVE_QUEUE', True)
         
         # 代理设置
-        self.proxy_enabled = os.getenv('PROXY_ENABLED', 'false').lower() == 'true'
-        self.proxy_type = os.getenv('PROXY_TYPE', 'socks5')  # socks5, socks4, http
-        self.proxy_host = os.getenv('PROXY_HOST', '')
-        self.proxy_port = int(os.getenv('PROXY_PORT', '1080'))
-        self.proxy_username = os.getenv('PROXY_USERNAME', '')
-        self.proxy_password = os.getenv('PROXY_PASSWORD', '')
-        self.proxy_rdns = os.getenv('PROXY_RDNS', 'true').lower() == 'true'
+        self.proxy_enabled = self._get_bool_env(env, 'PROXY_ENABLED', False)
+        self.proxy_type = env.get('PROXY_TYPE', 'socks5')  # socks5, socks4, http
+        self.proxy_host = env.get('PROXY_HOST', '')
+        self.proxy_port = self._get_int_env(env, 'PROXY_PORT', 1080)
+        self.proxy_username = env.get('PROXY_USERNAME', '')
+        self.proxy_password = env.get('PROXY_PASSWORD', '')
+        self.proxy_rdns = self._get_bool_env(env, 'PROXY_RDNS', True)
         
         # 代理轮换设置 (高级功能)
-        self.proxy_rotation_enabled = os.getenv('PROXY_ROTATION_ENABLED', 'false').lower() == 'true'
-        self.proxy_rotation_interval = int(os.getenv('PROXY_ROTATION_INTERVAL', '3600'))  # 1小时
-        self.proxy_list_file = os.getenv('PROXY_LIST_FILE', './proxy_list.txt')
+        self.proxy_rotation_enabled = self._get_bool_env(env, 'PROXY_ROTATION_ENABLED', False)
+        self.proxy_rotation_interval = self._get_int_env(env, 'PROXY_ROTATION_INTERVAL', 3600)  # 1小时
+        self.proxy_list_file = env.get('PROXY_LIST_FILE', './proxy_list.txt')
         
         # 代理测试设置
-        self.proxy_test_enabled = os.getenv('PROXY_TEST_ENABLED', 'true').lower() == 'true'
-        self.proxy_test_timeout = int(os.getenv('PROXY_TEST_TIMEOUT', '10'))  # 10秒
+        self.proxy_test_enabled = self._get_bool_env(env, 'PROXY_TEST_ENABLED', True)
+        self.proxy_test_timeout = self._get_int_env(env, 'PROXY_TEST_TIMEOUT', 10)  # 10秒
+        
+        # 代理配置缓存（配置启动后不再变化；代理轮换由 ProxyManager 使用自己的代理列表，不修改这里的字段）
+        self._proxy_config_cache = None
         
         # 验证配置
         self._validate_config()
     
-    def _get_required_env(self, key: str, value_type=str):
+    def _get_required_env(self, env: dict, key: str, value_type=str):
         """获取必需的环境变量"""
-        value = os.getenv(key)
+        value = env.get(key)
         if not value:
             raise ValueError(f"必需的环境变量 {key} 未设置")
         
@@ -91,23 +174,35 @@ class Config:
                 raise ValueError(f"环境变量 {key} 必须是数字")
         return value
     
+    def _get_int_env(self, env: dict, key: str, default: int) -> int:
+        """获取整数型环境变量"""
+        value = env.get(key)
+        if value is None or not value.strip():
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f"环境变量 {key} 必须是数字")
+    
+    def _get_bool_env(self, env: dict, key: str, default: bool) -> bool:
+        """获取布尔型环境变量"""
+        value = env.get(key)
+        if value is None:
+            return default
+        return value.strip().lower() in _TRUE_VALUES
+    
     def _get_optional_env(self, key: str) -> Optional[str]:
         """获取可选的环境变量"""
         return os.getenv(key)
     
     def _parse_file_size(self, size_str: str) -> int:
         """解析文件大小字符串为字节数"""
-        size_str = size_str.upper().strip()
-        
-        if size_str.endswith('KB'):
-            return int(size_str[:-2]) * 1024
-        elif size_str.endswith('MB'):
-            return int(size_str[:-2]) * 1024 * 1024
-        elif size_str.endswith('GB'):
-            return int(size_str[:-2]) * 1024 * 1024 * 1024
-        else:
-            # 假设是字节数
-            return int(size_str)
+        match = _SIZE_RE.match(size_str.strip())
+        if not match:
+            raise ValueError(f"无效的文件大小: {size_str}")
+        
+        number, unit = match.groups()
+        return int(number) * _SIZE_MULTIPLIERS[(unit or '').upper()]
     
     def _validate_config(self):
         """验证配置"""
@@ -121,21 +216,16 @@ class Config:
         if not self.phone_number.startswith('+'):
             raise ValueError("PHONE_NUMBER 必须以+开头（国际格式）")
         
-        # 验证频道ID格式（允许更灵活的格式）
-        if not (self.source_channel_id.startswith('@') or 
-                self.source_channel_id.startswith('-') or
-                self.source_channel_id.isdigit()):
-            raise ValueError("源频道ID必须以@、-开头或为纯数字")
+        # 验证频道ID格式
+        for channel_id in [self.source_channel_id, *self.source_channels]:
+            if not _CHANNEL_ID_RE.match(channel_id):
+                raise ValueError(f"源频道ID必须为@用户名或数字ID: {channel_id}")
         
-        if not (self.target_channel_id.startswith('@') or 
-                self.target_channel_id.startswith('-') or
-                self.target_channel_id.isdigit()):
-            raise ValueError("目标频道ID必须以@、-开头或为纯数字")
+        if not _CHANNEL_ID_RE.match(self.target_channel_id):
+            raise ValueError("目标频道ID必须为@用户名或数字ID")
         
         # 验证下载路径
-        download_path = Path(self.download_path)
-        if not download_path.exists():
-            download_path.mkdir(parents=True, exist_ok=True)
+        self.download_dir.mkdir(parents=True, exist_ok=True)
         
         # 验证会话路径
         if not self.session_path.exists():
@@ -145,6 +235,29 @@ class Config:
         if self.max_file_size <= 0:
             raise ValueError("最大文件大小必须大于0")
         
+        # 验证并发上传数量
+        if self.max_parallel_uploads <= 0:
+            raise ValueError("MAX_PARALLEL_UPLOADS 必须大于0")
+        
+        if self.upload_workers <= 0:
+            raise ValueError("UPLOAD_WORKERS 必须大于0")
+        
+        if self.forward_concurrency <= 0:
+            raise ValueError("FORWARD_CONCURRENCY 必须大于0")
+        
+        if self.max_batch <= 0:
+            raise ValueError("MAX_BATCH 必须大于0")
+        
+        if self.max_concurrent_messages <= 0:
+            raise ValueError("MAX_CONCURRENT_MESSAGES 必须大于0")
+        
+        # 验证发送速率限制
+        if self.send_rate_global <= 0 or self.send_rate_per_chat <= 0:
+            raise ValueError("SEND_RATE_GLOBAL 和 SEND_RATE_PER_CHAT 必须大于0")
+        
+        if self.forwards_per_minute <= 0:
+            raise ValueError("FORWARDS_PER_MINUTE 必须大于0")
+        
         # 验证代理配置
         if self.proxy_enabled:
             if not self.proxy_host:
@@ -161,21 +274,14 @@ class Config:
         if not self.proxy_enabled:
             return None
         
-        # 导入socks模块来获取代理类型常量
-        try:
-            import socks
-        except ImportError:
-            raise ImportError("需要安装 PySocks: pip install PySocks")
+        if self._proxy_config_cache is not None:
+            return self._proxy_config_cache
         
-        # 映射代理类型
-        proxy_type_map = {
-            'socks5': socks.SOCKS5,
-            'socks4': socks.SOCKS4,
-            'http': socks.HTTP
-        }
+        if _SOCKS_TYPES is None:
+            raise ImportError("需要安装 PySocks: pip install PySocks")
         
         proxy_config = {
-            'proxy_type': proxy_type_map[self.proxy_type],
+            'proxy_type': _SOCKS_TYPES[self.proxy_type],
             'addr': self.proxy_host,
             'port': self.proxy_port,
             'rdns': self.proxy_rdns
@@ -186,6 +292,7 @@ class Config:
             proxy_config['username'] = self.proxy_username
             proxy_config['password'] = self.proxy_password
         
+        self._proxy_config_cache = proxy_config
         return proxy_config
     
     def get_proxy_info_string(self):
@@ -5,47 +5,146 @@ Telegram User Client for downloading media from source channel and forwarding to
 """
 
 import asyncio
+import atexit
 import logging
 import os
+import queue
+import re
 import signal
 import sys
-from pathlib import Path
-from typing import Optional
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 import random
+from collections import deque
 from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
 
 from dotenv import load_dotenv
-from telethon import TelegramClient, events
+from telethon import TelegramClient, events, utils
 from telethon.tl.types import Message
-from telethon.errors import RPCError
+from telethon.errors import FloodWaitError
 
 from bot_handler import TelegramBotHandler
 from media_downloader import MediaDownloader
 from config import Config
 from message_queue import MessageQueue
 from proxy_manager import ProxyManager
+from rate_limiter import RateLimiter
+
+# 可选: uvloop 事件循环，降低每次回调和 socket 操作的开销 (不支持 Windows)
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
 # 加载环境变量
 load_dotenv()
 
-# 配置日志
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO,
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+# 配置日志：事件循环中只把日志放入队列，由后台线程写入文件和控制台
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [logging.FileHandler('bot.log', delay=True), logging.StreamHandler(sys.stdout)]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+# 队列端只保留原始消息，完整格式由后台线程中的处理器负责
+logging.basicConfig(format='%(message)s', level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 logger = logging.getLogger(__name__)
 
+# 批量转发进度回调 (已完成数, 已获取数)
+ProgressCallback = Optional[Callable[[int, int], Awaitable[None]]]
+
+
+# Python 3.12+ 提供 eager_task_factory：新任务立即同步执行到第一个 await
+_eager_task_factory = getattr(asyncio, 'eager_task_factory', None)
+
+
+def _create_eager_task(coro) -> asyncio.Task:
+    """创建立即开始执行的任务，只用于本程序的消息处理任务，不改变事件循环的任务工厂（Telethon 内部任务不受影响）"""
+    if _eager_task_factory is None:
+        return asyncio.create_task(coro)
+    return _eager_task_factory(asyncio.get_running_loop(), coro)
+
+
+async def _iter_list(items: list) -> AsyncIterator:
+    """把列表包装成异步迭代器"""
+    for item in items:
+        yield item
+
+
+class MediaGroupState:
+    """正在收集/下载的媒体组状态"""
+    
+    __slots__ = ('messages', 'media_messages', 'new_msg_event', 'worker', 'main_message', 'status', 'download_start_time')
+    
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.media_messages: List[Message] = []       # 包含媒体的消息，收集时筛选
+        self.new_msg_event = asyncio.Event()          # 收到新消息时置位，用于延长收集窗口
+        self.worker: Optional[asyncio.Task] = None    # 该组唯一的收集/下载协程
+        self.main_message: Optional[Message] = None   # 第一条带文案的消息
+        self.status = 'collecting'                    # collecting, downloading, completed
+        self.download_start_time: Optional[float] = None
+
 
 class TelegramUserClient:
+    # 进度消息最短更新间隔（秒）
+    PROGRESS_EDIT_INTERVAL = 5
+    # 随机下载时扫描的历史消息数量
+    RANDOM_SAMPLE_POOL = 100
+    # 批量转发时预取、等待下载的历史消息数量
+    HISTORY_PREFETCH_SIZE = 50
+    # 下载完成、等待转发的消息队列长度（队列满时下载端等待，形成背压）
+    FORWARD_QUEUE_SIZE = 32
+    # 超过 FLOOD_SLEEP_THRESHOLD 的 FloodWait 最多等待重试的次数
+    FLOOD_WAIT_RETRIES = 2
+    # /help 命令的回复内容
+    HELP_TEXT = """🎮 **可用命令：**
+
+📥 `/download <频道ID> <天数> [数量]` - 下载指定频道指定日期的消息
+   例如: `/download @channel1 0 20` (下载今天的20条消息)
+   例如: `/download @channel1 3 50` (下载3天前的50条消息)
+   例如: `/download -1001234567890 7 30` (下载7天前的30条消息)
+
+📊 `/status` - 显示当前状态和队列信息
+📋 `/queue <操作>` - 队列管理命令
+   `/queue status` - 查看队列状态
+   `/queue clear` - 清空队列
+   `/queue start` - 启动队列处理
+   `/queue stop` - 停止队列处理
+
+🔄 `/mode <模式>` - 切换转发模式
+   `/mode immediate` - 立即转发模式
+   `/mode queue` - 队列延迟转发模式
+
+🔗 `/proxy [操作]` - 代理管理命令
+   `/proxy` - 查看代理状态
+   `/proxy status` - 查看当前代理
+   `/proxy test` - 测试所有代理
+   `/proxy rotate` - 强制轮换代理
+   `/proxy stats` - 详细统计信息
+
+❓ `/help` - 显示此帮助信息
+
+💡 **提示：**
+  • 频道ID可以是 @username 或数字ID格式
+  • 天数=0表示今天，1表示昨天，以此类推
+  • 数量默认为50条消息
+  • 队列模式支持延迟发送和批量处理
+  • 系统会自动添加随机延迟避免被检测
+  • 只有你本人可以使用这些命令"""
+    
     def __init__(self):
         self.config = Config()
         self.bot_handler = TelegramBotHandler(self.config)
         self.media_downloader = MediaDownloader(self.config)
         self.client = None
+        self._loop = None  # 运行中的事件循环（start_client 时获取）
+        self.me = None  # 当前登录账号（启动时获取一次）
         
         # 消息队列系统
         self.message_queue = MessageQueue(self.config)
@@ -54,7 +153,7 @@ class TelegramUserClient:
         self.proxy_manager = ProxyManager(self.config)
         
         # 媒体组缓存 (复用原有逻辑)
-        self.media_groups = {}  # {media_group_id: {'messages': [], 'timer': asyncio.Task, 'last_message_time': float, 'status': str, 'download_start_time': float}}
+        self.media_groups: Dict[int, MediaGroupState] = {}
         self.media_group_timeout = 3  # 秒 - 等待更多消息的时间
         self.media_group_max_wait = 60  # 秒 - 等待新消息的最大时间
         self.download_timeout = 3600  # 秒 - 下载超时时间（1小时）
@@ -65,6 +164,52 @@ class TelegramUserClient:
         self.random_delay_max = self.config.random_delay_max
         self.batch_delay_min = self.config.batch_delay_min
         self.batch_delay_max = self.config.batch_delay_max
+        # 下一次实时下载最早可以开始的时间（事件循环时钟）
+        self._next_live_slot = 0.0
+        
+        # 源频道数字ID -> 标题（启动时解析一次）
+        self._source_channel_titles = {}
+        # /status 中显示的源频道列表，配置不变，只生成一次
+        self._source_channels_text = "\n".join(f"  • `{ch}`" for ch in self.config.source_channels)
+        # 源频道数字ID集合，新消息事件过滤时使用
+        self._source_ids = frozenset()
+        # 配置中的频道ID -> 已解析的频道实体，避免重复 get_entity 请求
+        self._channel_entities = {}
+        
+        # 最近收到的源频道消息缓存，手动下载最新消息时优先使用，减少历史消息请求
+        self._recent_messages = deque(maxlen=self.config.msg_cache_size)
+        
+        # 下载并发控制（批量转发和媒体组下载共用）
+        self._download_semaphore = asyncio.Semaphore(self.config.forward_concurrency)
+        # 所有转发共用的速率限制（每分钟 FORWARDS_PER_MINUTE 条）
+        self._forward_limiter = RateLimiter(self.config.forwards_per_minute, self.config.forwards_per_minute, period=60)
+        
+        # 新消息/媒体组后台处理任务及并发控制
+        self._inflight = set()
+        self._message_semaphore = asyncio.Semaphore(self.config.max_concurrent_messages)
+        
+        # 下载 -> 转发流水线：下载完成的消息放入队列，由转发协程并发发送
+        self._forward_queue = asyncio.Queue(maxsize=self.FORWARD_QUEUE_SIZE)
+        self._forward_workers = []
+        # 转发成功后待删除的本地文件，由一个后台协程批量删除
+        self._cleanup_queue = asyncio.Queue()
+        self._cleanup_worker: Optional[asyncio.Task] = None
+        
+        # 收到退出信号后置位，先处理完进行中的消息再断开连接
+        self._shutdown_event = asyncio.Event()
+        # 新消息事件处理器，退出时先注销，不再接收新消息
+        self._new_message_handler = None
+        
+        # 私聊命令 -> 处理函数 (event, args)，事件过滤的正则也由此生成
+        self._command_handlers = {
+            "help": lambda event, args: self._send_help_message(event),
+            "status": lambda event, args: self._send_status_message(event),
+            "download": self._handle_telegram_download_command,
+            "queue": self._handle_queue_command,
+            "mode": self._handle_mode_command,
+            "proxy": self._handle_proxy_command,
+        }
+        self._command_pattern = re.compile(r'^/(?:%s)\b' % '|'.join(self._command_handlers))
         
         # 命令控制
         self.running = True
@@ -84,6 +229,21 @@ class TelegramUserClient:
         logger.info(f"⏰ 智能延迟 {delay:.1f} 秒（类型: {delay_type}）")
         await asyncio.sleep(delay)
     
+    async def _wait_live_slot(self):
+        """实时消息下载节流：相邻两次下载至少间隔一个随机延迟
+        
+        空闲时直接开始，只有消息密集到达时才排队等待，而不是每条消息都固定睡眠。
+        """
+        now = self._loop.time()
+        start = max(now, self._next_live_slot)
+        # 先预留时间段再等待，并发到达的消息依次排在后面
+        self._next_live_slot = start + random.uniform(self.random_delay_min, self.random_delay_max)
+        
+        delay = start - now
+        if delay > 0:
+            logger.info("⏰ 消息密集，延迟 %.1f 秒后下载", delay)
+            await asyncio.sleep(delay)
+    
     async def _handle_command_message(self, event):
         """处理Telegram私聊命令"""
         try:
@@ -97,20 +257,11 @@ class TelegramUserClient:
             parts = message_text.split()
             command = parts[0][1:].lower()  # 移除 '/' 前缀
             
-            if command == "help":
-                await self._send_help_message(event)
-            elif command == "status":
-                await self._send_status_message(event)
-            elif command == "download":
-                await self._handle_telegram_download_command(event, parts[1:])
-            elif command == "queue":
-                await self._handle_queue_command(event, parts[1:])
-            elif command == "mode":
-                await self._handle_mode_command(event, parts[1:])
-            elif command == "proxy":
-                await self._handle_proxy_command(event, parts[1:])
-            else:
+            handler = self._command_handlers.get(command)
+            if handler is None:
                 await event.respond("❌ 未知命令，请使用 /help 查看可用命令")
+                return
+            await handler(event, parts[1:])
             
         except Exception as e:
             logger.error(f"❌ 处理Telegram命令时出错: {e}")
@@ -118,63 +269,33 @@ class TelegramUserClient:
     
     async def _send_help_message(self, event):
         """发送帮助消息"""
-        help_text = """🎮 **可用命令：**
-
-📥 `/download <频道ID> <天数> [数量]` - 下载指定频道指定日期的消息
-   例如: `/download @channel1 0 20` (下载今天的20条消息)
-   例如: `/download @channel1 3 50` (下载3天前的50条消息)
-   例如: `/download -1001234567890 7 30` (下载7天前的30条消息)
-
-📊 `/status` - 显示当前状态和队列信息
-📋 `/queue <操作>` - 队列管理命令
-   `/queue status` - 查看队列状态
-   `/queue clear` - 清空队列
-   `/queue start` - 启动队列处理
-   `/queue stop` - 停止队列处理
-
-🔄 `/mode <模式>` - 切换转发模式
-   `/mode immediate` - 立即转发模式
-   `/mode queue` - 队列延迟转发模式
-
-🔗 `/proxy [操作]` - 代理管理命令
-   `/proxy` - 查看代理状态
-   `/proxy status` - 查看当前代理
-   `/proxy test` - 测试所有代理
-   `/proxy rotate` - 强制轮换代理
-   `/proxy stats` - 详细统计信息
-
-❓ `/help` - 显示此帮助信息
-
-💡 **提示：**
-  • 频道ID可以是 @username 或数字ID格式
-  • 天数=0表示今天，1表示昨天，以此类推
-  • 数量默认为50条消息
-  • 队列模式支持延迟发送和批量处理
-  • 系统会自动添加随机延迟避免被检测
-  • 只有你本人可以使用这些命令"""
-        
-        await event.respond(help_text)
+        await event.respond(self.HELP_TEXT)
     
     async def _send_status_message(self, event):
         """发送状态消息"""
         # 获取队列状态
         queue_status = self.message_queue.get_status()
         
+        # 在线程中统计下载目录，避免慢磁盘阻塞事件循环
+        download_stats = await asyncio.to_thread(self.media_downloader.get_download_stats)
+        
         # 构建基本状态信息
         status_text = f"""📊 **系统状态：**
 
 🔗 客户端连接: {'✅ 已连接' if self.client and self.client.is_connected() else '❌ 未连接'}
+👤 当前账号: {f"{self.me.first_name} (@{self.me.username})" if self.me else '未知'}
 📡 监听频道数: {len(self.config.source_channels)}
 🎯 目标频道: `{self.config.target_channel_id}`
 ⏱️ 随机延迟: {self.random_delay_min}-{self.random_delay_max}秒
 📦 批量延迟: {self.batch_delay_min}-{self.batch_delay_max}秒
 📁 下载路径: `{self.config.download_path}`
+📂 本地文件: {download_stats['total_files']} 个 ({download_stats['total_size_mb']:.1f}MB)
 📏 最大文件: {self.config.max_file_size / (1024**3):.1f}GB
 
 🔄 **转发模式：** {'📋 队列延迟转发' if queue_status['enabled'] else '⚡ 立即转发'}
 
 📋 **监听的源频道：**
-{chr(10).join([f'  • `{ch}`' for ch in self.config.source_channels])}"""
+{self._source_channels_text}"""
 
         # 添加队列状态信息
         if queue_status['enabled']:
@@ -213,20 +334,42 @@ class TelegramUserClient:
 • `/download @channel1 3 50` (下载3天前的50条消息)""")
             return
             
+        channel_id = args[0]
+        days_arg = args[1]
+        limit_arg = args[2] if len(args) > 2 else None
+        # isdecimal 而不是 isdigit：'²' 等字符 isdigit 为 True，但 int() 无法转换
+        if not days_arg.isdecimal() or (limit_arg is not None and not limit_arg.isdecimal()):
+            await event.respond("❌ 参数错误：天数和数量必须是非负整数")
+            return
+        
+        days_ago = int(days_arg)
+        limit = int(limit_arg) if limit_arg is not None else min(50, self.config.max_batch)
+        if not 1 <= limit <= self.config.max_batch:
+            await event.respond(f"❌ 数量必须在1-{self.config.max_batch}之间")
+            return
+        
         try:
-            channel_id = args[0]
-            days_ago = int(args[1])
-            limit = int(args[2]) if len(args) > 2 else 50
-            
-            await event.respond(f"🚀 开始执行下载命令...\n📡 频道: `{channel_id}`\n📅 日期: {days_ago}天前\n📊 数量: {limit}条消息")
+            header = f"📡 频道: `{channel_id}`\n📅 日期: {days_ago}天前\n📊 数量: {limit}条消息"
+            status_message = await event.respond(f"🚀 开始执行下载命令...\n{header}")
+            last_edit = time.monotonic()
+            
+            async def report_progress(done: int, total: int):
+                # 同一条状态消息节流更新，避免每条消息都发送进度；全部完成时总是更新
+                nonlocal last_edit
+                now = time.monotonic()
+                if done != total and now - last_edit < self.PROGRESS_EDIT_INTERVAL:
+                    return
+                last_edit = now
+                try:
+                    await status_message.edit(f"📤 正在转发... {done}/{total}\n{header}")
+                except Exception as e:
+                    logger.debug(f"更新进度消息失败: {e}")
             
             # 执行下载
-            count = await self.command_download_by_channel_date(channel_id, days_ago, limit)
+            count = await self.command_download_by_channel_date(channel_id, days_ago, limit, progress=report_progress)
             
-            await event.respond(f"✅ **下载完成！**\n📊 成功处理了 **{count}** 条消息")
+            await status_message.edit(f"✅ **下载完成！**\n{header}\n📊 成功处理了 **{count}** 条消息")
             
-        except ValueError:
-            await event.respond("❌ 参数错误：天数和数量必须是数字")
         except Exception as e:
             logger.error(f"❌ Telegram下载命令执行失败: {e}")
             await event.respond(f"❌ 下载失败: {str(e)}")
@@ -318,22 +461,36 @@ class TelegramUserClient:
     async def _test_proxy_connection(self):
         """测试代理连接"""
         try:
-            import socket
-            import socks
-            
-            logger.info("🔍 正在测试代理连接...")
-            
-            # 创建socket并设置代理
-            sock = socks.socksocket()
-            
-            # 根据代理类型设置
-            if self.config.proxy_type == 'socks5':
-                proxy_type = socks.SOCKS5
-            elif self.config.proxy_type == 'socks4':
-                proxy_type = socks.SOCKS4
-            else:  # http
-                proxy_type = socks.HTTP
-            
+            import socks  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️ 未安装PySocks，跳过代理测试。请运行: pip install PySocks")
+            return True  # 跳过测试，继续执行
+        
+        logger.info("🔍 正在测试代理连接...")
+        
+        # 连接是阻塞调用，在线程中执行，代理不可达时不会冻结事件循环
+        try:
+            await asyncio.to_thread(self._probe_proxy_connection)
+            logger.info("✅ 代理连接测试成功")
+            return True
+        except Exception as connect_error:
+            logger.error(f"❌ 代理连接测试失败: {connect_error}")
+            return False
+    
+    def _probe_proxy_connection(self):
+        """通过配置的代理连接 Telegram 服务器，失败时抛出异常（在线程中执行）"""
+        import socks
+        
+        # 根据代理类型设置
+        if self.config.proxy_type == 'socks5':
+            proxy_type = socks.SOCKS5
+        elif self.config.proxy_type == 'socks4':
+            proxy_type = socks.SOCKS4
+        else:  # http
+            proxy_type = socks.HTTP
+        
+        sock = socks.socksocket()
+        try:
             # 设置代理
             if self.config.proxy_username and self.config.proxy_password:
                 sock.set_proxy(
@@ -354,68 +511,59 @@ class TelegramUserClient:
             sock.settimeout(self.config.proxy_test_timeout)
             
             # 尝试连接到Telegram的服务器
-            try:
-                sock.connect(('149.154.167.50', 443))  # Telegram DC1
-                sock.close()
-                logger.info("✅ 代理连接测试成功")
-                return True
-            except Exception as connect_error:
-                logger.error(f"❌ 代理连接测试失败: {connect_error}")
-                return False
-                
-        except ImportError:
-            logger.warning("⚠️ 未安装PySocks，跳过代理测试。请运行: pip install PySocks")
-            return True  # 跳过测试，继续执行
-        except Exception as e:
-            logger.error(f"❌ 代理测试过程出错: {e}")
-            return False
+            sock.connect(('149.154.167.50', 443))  # Telegram DC1
+        finally:
+            sock.close()
     
     async def start_client(self):
         """启动 Telethon 客户端"""
+        self._loop = asyncio.get_running_loop()
         try:
+            # cryptg 提供 C 实现的 MTProto 加密，Telethon 会自动使用
+            try:
+                import cryptg  # noqa: F401
+            except ImportError:
+                logger.warning("⚠️ 未安装 cryptg，上传/下载速度将慢 5-10 倍。请运行: pip install cryptg")
+            
             # 创建客户端实例
             session_path = self.config.session_path / f"{self.config.session_name}.session"
             
             # 获取代理配置（通过代理管理器）
             proxy_config = await self.proxy_manager.get_current_proxy_config()
             
+            # FloodWait 小于阈值时由 Telethon 自动等待后重试，而不是抛出异常
+            client_kwargs = {'flood_sleep_threshold': self.config.flood_sleep_threshold}
+            
             if proxy_config:
                 logger.info(f"🔗 使用代理连接: {self.proxy_manager.get_current_proxy_info()}")
                 
                 # 创建带代理的客户端
-                self.client = TelegramClient(
-                    str(session_path),
-                    self.config.api_id,
-                    self.config.api_hash,
-                    proxy=proxy_config
-                )
+                client_kwargs['proxy'] = proxy_config
             else:
                 logger.info("🚫 直连模式（未启用代理）")
-                self.client = TelegramClient(
-                    str(session_path),
-                    self.config.api_id,
-                    self.config.api_hash
-                )
+            
+            self.client = TelegramClient(
+                str(session_path),
+                self.config.api_id,
+                self.config.api_hash,
+                **client_kwargs
+            )
             
             # 启动客户端
             await self.client.start(phone=self.config.phone_number)
             
-            # 获取客户端信息
-            me = await self.client.get_me()
-            logger.info(f"✅ 用户客户端已启动: {me.first_name} (@{me.username})")
+            # 获取客户端信息（账号信息运行期间不变，缓存供状态命令使用）
+            self.me = await self.client.get_me()
+            logger.info(f"✅ 用户客户端已启动: {self.me.first_name} (@{self.me.username})")
             
             # 检查频道权限
             if not await self.bot_handler.check_permissions(self.client):
                 raise ValueError("频道权限检查失败")
             
-            # 创建下载目录
-            download_path = Path(self.config.download_path)
-            download_path.mkdir(exist_ok=True)
-            
             logger.info("🎯 User Client 配置信息:")
             logger.info(f"源频道: {self.config.source_channel_id}")
             logger.info(f"目标频道: {self.config.target_channel_id}")
-            logger.info(f"下载目录: {download_path.absolute()}")
+            logger.info(f"下载目录: {self.config.download_dir}")
             logger.info(f"最大文件大小: {self.config.max_file_size / (1024*1024*1024):.1f}GB")
             
             return True
@@ -427,37 +575,33 @@ class TelegramUserClient:
     async def setup_handlers(self):
         """设置事件处理器 - 支持多源频道"""
         try:
-            # 获取所有源频道实体
+            # 并发获取所有源频道实体，启动耗时不随频道数量线性增长
+            results = await asyncio.gather(
+                *(self._get_channel_entity(channel_id) for channel_id in self.config.source_channels),
+                return_exceptions=True
+            )
+            
             source_entities = []
-            for channel_id in self.config.source_channels:
-                try:
-                    entity = await self.client.get_entity(channel_id)
-                    source_entities.append(entity)
-                    logger.info(f"✅ 已连接到源频道: {getattr(entity, 'title', 'Unknown')} ({channel_id})")
-                except Exception as e:
-                    logger.error(f"❌ 无法连接到频道 {channel_id}: {e}")
+            for channel_id, entity in zip(self.config.source_channels, results):
+                if isinstance(entity, Exception):
+                    logger.error(f"❌ 无法连接到频道 {channel_id}: {entity}")
                     continue
+                source_entities.append(entity)
+                # 缓存解析后的数字ID -> 频道标题，处理消息时无需再解析
+                self._source_channel_titles[utils.get_peer_id(entity)] = getattr(entity, 'title', 'Unknown')
+                logger.info(f"✅ 已连接到源频道: {getattr(entity, 'title', 'Unknown')} ({channel_id})")
             
             if not source_entities:
                 raise ValueError("没有成功连接到任何源频道")
             
-            # 为所有源频道设置新消息事件处理器
-            @self.client.on(events.NewMessage(chats=source_entities))
-            async def handle_new_message(event):
-                # 添加频道信息到日志
-                channel_title = getattr(event.chat, 'title', 'Unknown')
-                logger.info(f"📨 来自频道 '{channel_title}' 的新消息")
-                await self._handle_message(event.message)
-            
-            # 设置私聊命令处理器（用于手动控制）
-            @self.client.on(events.NewMessage(pattern=r'^/(download|status|help)', incoming=True))
-            async def command_handler(event):
-                if event.is_private:  # 只处理私聊消息
-                    logger.info(f"📱 收到私聊命令: {event.message.text}")
-                    await self._handle_command_message(event)
+            self._source_ids = frozenset(self._source_channel_titles)
+            
+            # 只注册一个新消息处理器，源频道消息和私聊命令在内部分发，每条更新只过滤一次
+            self._new_message_handler = self._on_new_message
+            self.client.add_event_handler(self._new_message_handler, events.NewMessage())
             
             logger.info(f"✅ 事件处理器已设置，正在监听 {len(source_entities)} 个源频道的新消息...")
-            logger.info("✅ 私聊命令处理器已设置 (/download, /status, /help)")
+            logger.info("✅ 私聊命令处理器已设置 (%s)", ', '.join(f"/{command}" for command in self._command_handlers))
             
             # 显示监听的频道列表
             for entity in source_entities:
@@ -467,55 +611,115 @@ class TelegramUserClient:
             logger.error(f"设置事件处理器失败: {e}")
             raise
     
+    async def _on_new_message(self, event):
+        """新消息事件：源频道消息后台处理，有权限的私聊命令直接执行"""
+        if self._shutdown_event.is_set():
+            # 正在退出：注销前已分发的事件也不再处理
+            return
+        if event.chat_id in self._source_ids:
+            # 添加频道信息到日志
+            channel_title = self._get_source_channel_title(event.chat_id)
+            logger.info("📨 来自频道 '%s' 的新消息", channel_title)
+            # 互不相关的消息在后台并发处理，不阻塞后续消息
+            # 很快结束的消息（如纯文本、已缓存的媒体）无需等待下一轮调度
+            self._track_task(_create_eager_task(self._handle_message(event.message)))
+        elif event.is_private and self._command_pattern.match(event.raw_text):
+            if not self._is_command_sender(event):
+                logger.warning("⚠️ 忽略来自用户 %s 的私聊命令（不在 ADMIN_USER_IDS 中）", event.sender_id)
+                return
+            # 私聊命令（用于手动控制）
+            logger.info("📱 收到私聊命令: %s", event.message.text)
+            await self._handle_command_message(event)
+    
+    def _is_command_sender(self, event) -> bool:
+        """只接受本账号在收藏夹中发送的命令，以及 ADMIN_USER_IDS 中的用户发来的命令"""
+        if event.out:
+            # 本账号发给其他人的私聊不是命令
+            return self.me is not None and event.chat_id == self.me.id
+        return event.sender_id in self.config.admin_user_ids
+    
+    def _track_task(self, task: asyncio.Task) -> asyncio.Task:
+        """记录后台处理任务，退出前等待其完成"""
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+        return task
+    
+    def request_shutdown(self, signum: int):
+        """信号处理：第一次请求优雅退出，再次收到信号时取消进行中的任务强制退出"""
+        if self._shutdown_event.is_set():
+            logger.warning("再次收到信号 %s，取消进行中的任务并立即退出", signum)
+            for task in (*self._inflight, *self._forward_workers):
+                task.cancel()
+            return
+        logger.info("收到信号 %s，处理完进行中的消息后退出（再次发送信号强制退出）...", signum)
+        self._shutdown_event.set()
+    
+    async def _get_channel_entity(self, channel_id):
+        """获取频道实体，解析结果在运行期间缓存"""
+        entity = self._channel_entities.get(channel_id)
+        if entity is None:
+            entity = await self.client.get_entity(channel_id)
+            self._channel_entities[channel_id] = entity
+        return entity
+    
+    def _get_source_channel_title(self, chat_id: int) -> str:
+        """从启动时缓存的源频道信息中获取频道标题"""
+        return self._source_channel_titles.get(chat_id, 'Unknown')
+    
     async def _handle_message(self, message: Message):
         """处理接收到的消息"""
         try:
-            logger.info(f"收到来自源频道的消息: {message.id}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("收到来自源频道的消息: %s (频道ID: %s)", message.id, message.chat_id)
+            self._recent_messages.append(message)
             
             # 检查是否是媒体组消息
             if message.grouped_id:
-                logger.info(f"消息 {message.id} 属于媒体组: {message.grouped_id}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("消息 %s 属于媒体组: %s", message.id, message.grouped_id)
                 await self._handle_media_group_message(message)
             else:
                 # 处理单独的消息
                 await self._handle_single_message(message)
                 
         except Exception as e:
-            logger.error(f"处理消息 {message.id} 时出错: {e}")
+            logger.error("处理消息 %s 时出错: %s", message.id, e)
     
     async def _handle_single_message(self, message: Message):
         """处理单独的消息 - 支持队列系统"""
-        logger.info(f"🔄 开始处理单独消息 {message.id}")
+        logger.info("🔄 开始处理单独消息 %s", message.id)
         
         # 获取频道标题
-        channel_title = getattr(message.chat, 'title', 'Unknown')
+        channel_title = self._get_source_channel_title(message.chat_id)
         
-        # 检查是否启用队列模式
-        if self.config.queue_enabled:
-            await self._handle_message_with_queue(message, channel_title)
-        else:
-            await self._handle_message_immediate(message)
+        # 限制同时下载/转发的消息数
+        async with self._message_semaphore:
+            # 检查是否启用队列模式
+            if self.config.queue_enabled:
+                await self._handle_message_with_queue(message, channel_title)
+            else:
+                await self._handle_message_immediate(message)
     
     async def _handle_message_with_queue(self, message: Message, channel_title: str):
         """使用队列模式处理消息"""
-        logger.info(f"📋 队列模式：处理消息 {message.id}")
+        logger.info("📋 队列模式：处理消息 %s", message.id)
         
         downloaded_files = []
         
         # 检查消息是否包含媒体
         if self.bot_handler.has_media(message):
-            logger.info(f"📥 消息 {message.id} 包含媒体，开始下载...")
+            logger.info("📥 消息 %s 包含媒体，开始下载...", message.id)
             
             try:
                 downloaded_files = await self.media_downloader.download_media(message, self.client)
                 
                 if downloaded_files:
-                    logger.info(f"📥 消息 {message.id} 下载完成，共 {len(downloaded_files)} 个文件")
+                    logger.info("📥 消息 %s 下载完成，共 %s 个文件", message.id, len(downloaded_files))
                 else:
-                    logger.warning(f"⚠️ 消息 {message.id} 没有可下载的媒体文件")
+                    logger.warning("⚠️ 消息 %s 没有可下载的媒体文件", message.id)
                     
             except Exception as e:
-                logger.error(f"❌ 消息 {message.id} 下载失败: {e}")
+                logger.error("❌ 消息 %s 下载失败: %s", message.id, e)
                 return
         
         # 添加到队列（包括纯文本消息）
@@ -526,233 +730,452 @@ class TelegramUserClient:
     
     async def _handle_message_immediate(self, message: Message):
         """立即模式处理消息（原有逻辑）"""
-        logger.info(f"⚡ 立即模式：处理消息 {message.id}")
+        logger.info("⚡ 立即模式：处理消息 %s", message.id)
         
-        # 添加智能随机延迟
-        await self.smart_delay("normal")
-            
         # 检查消息是否包含媒体
         if self.bot_handler.has_media(message):
-            logger.info(f"📥 消息 {message.id} 包含媒体，开始下载...")
+            # 只在真正需要下载时节流，纯文本消息直接交给转发协程（转发本身有速率限制）
+            await self._wait_live_slot()
+            logger.info("📥 消息 %s 包含媒体，开始下载...", message.id)
             
             try:
-                downloaded_files = await self.media_downloader.download_media(message, self.client)
+                downloaded_files = await self.media_downloader.download_media(
+                    message, self.client, in_memory=True, uploaded_media=self.bot_handler.get_uploaded_media
+                )
                 
                 if downloaded_files:
-                    logger.info(f"📥 消息 {message.id} 下载完成，共 {len(downloaded_files)} 个文件")
-                    logger.info(f"📤 开始转发消息 {message.id} 到目标频道...")
-                    
-                    # 转发消息到目标频道
-                    await self.bot_handler.forward_message(message, downloaded_files, self.client)
-                    logger.info(f"🎉 成功转发消息 {message.id} 到目标频道")
-                    
-                    # 自动清理已成功发布的文件
-                    logger.info(f"🧹 开始清理消息 {message.id} 的本地文件...")
-                    await self._cleanup_files(downloaded_files)
-                    logger.info(f"🧹 消息 {message.id} 文件清理完成")
+                    logger.info("📥 消息 %s 下载完成，共 %s 个文件，等待转发", message.id, len(downloaded_files))
+                    # 交给转发协程上传，当前协程可以继续处理下一条消息的下载
+                    await self._forward_queue.put((message, downloaded_files, "消息"))
                 else:
-                    logger.warning(f"⚠️ 消息 {message.id} 没有可下载的媒体文件")
-                    logger.info(f"   可能原因: 文件超过大小限制、网络错误或API限制")
+                    logger.warning("⚠️ 消息 %s 没有可下载的媒体文件", message.id)
+                    logger.info("   可能原因: 文件超过大小限制、网络错误或API限制")
                 
             except Exception as e:
-                logger.error(f"❌ 消息 {message.id} 下载失败: {e}")
-                logger.info(f"   消息将被跳过，不会转发到目标频道")
+                logger.error("❌ 消息 %s 下载失败: %s", message.id, e)
+                logger.info("   消息将被跳过，不会转发到目标频道")
         else:
-            logger.info(f"📝 消息 {message.id} 是纯文本消息")
-            # 转发纯文本消息
-            await self.bot_handler.forward_text_message(message, self.client)
-            logger.info(f"🎉 成功转发文本消息 {message.id} 到目标频道")
+            logger.info("📝 消息 %s 是纯文本消息", message.id)
+            await self._forward_queue.put((message, [], "消息"))
     
     async def _handle_media_group_message(self, message: Message):
         """处理媒体组消息 (复用原有逻辑)"""
         media_group_id = message.grouped_id
-        current_time = asyncio.get_event_loop().time()
+        group_data = self.media_groups.get(media_group_id)
         
-        # 如果媒体组不存在，创建新的
-        if media_group_id not in self.media_groups:
-            self.media_groups[media_group_id] = {
-                'messages': [],
-                'timer': None,
-                'last_message_time': current_time,
-                'start_time': current_time,
-                'status': 'collecting',  # collecting, downloading, completed
-                'download_start_time': None
-            }
+        # 如果媒体组不存在，或已结束收集（迟到的消息），创建新的并启动该组唯一的收集协程
+        if group_data is None or group_data.status != 'collecting':
+            if group_data is not None:
+                logger.warning("媒体组 %s 已开始下载，迟到的消息 %s 将单独处理", media_group_id, message.id)
+            group_data = MediaGroupState()
+            self.media_groups[media_group_id] = group_data
+            group_data.worker = self._track_task(
+                asyncio.create_task(self._media_group_worker(media_group_id, group_data))
+            )
         
-        # 添加消息到媒体组
-        self.media_groups[media_group_id]['messages'].append(message)
-        self.media_groups[media_group_id]['last_message_time'] = current_time
-        logger.info(f"媒体组 {media_group_id} 现在有 {len(self.media_groups[media_group_id]['messages'])} 条消息")
+        # 添加消息到媒体组，并通知收集协程延长等待窗口
+        group_data.messages.append(message)
+        if self.bot_handler.has_media(message):
+            group_data.media_messages.append(message)
+        if group_data.main_message is None and message.text:
+            group_data.main_message = message
+        group_data.new_msg_event.set()
+        logger.info("媒体组 %s 现在有 %s 条消息", media_group_id, len(group_data.messages))
+    
+    async def _media_group_worker(self, media_group_id: int, group_data: MediaGroupState):
+        """等待媒体组收集完毕后下载转发，每个媒体组只有一个协程，状态只由该协程修改"""
+        new_msg_event = group_data.new_msg_event
         
-        # 取消之前的定时器
-        if self.media_groups[media_group_id]['timer']:
-            self.media_groups[media_group_id]['timer'].cancel()
+        async def wait_until_quiet():
+            # 超过 media_group_timeout 秒没有新消息即认为收集完成
+            while True:
+                try:
+                    await asyncio.wait_for(new_msg_event.wait(), self.media_group_timeout)
+                except asyncio.TimeoutError:
+                    return
+                new_msg_event.clear()
         
-        # 设置新的定时器
-        self.media_groups[media_group_id]['timer'] = asyncio.create_task(
-            self._process_media_group_after_timeout(media_group_id)
-        )
-    
-    async def _process_media_group_after_timeout(self, media_group_id: str):
-        """智能处理媒体组超时 (复用原有逻辑)"""
         try:
-            # 等待超时
-            await asyncio.sleep(self.media_group_timeout)
+            try:
+                await asyncio.wait_for(wait_until_quiet(), self.media_group_max_wait)
+            except asyncio.TimeoutError:
+                # 超过最大等待时间，强制开始下载
+                logger.warning("媒体组 %s 等待新消息超时，开始下载", media_group_id)
             
-            if media_group_id not in self.media_groups:
-                return
-                
-            current_time = asyncio.get_event_loop().time()
-            group_data = self.media_groups[media_group_id]
-            
-            # 状态机处理
-            if group_data['status'] == 'collecting':
-                # 收集阶段：检查是否还有新消息
-                if current_time - group_data['last_message_time'] < self.media_group_timeout:
-                    # 还有新消息，重新设置定时器
-                    group_data['timer'] = asyncio.create_task(
-                        self._process_media_group_after_timeout(media_group_id)
-                    )
-                    return
-                elif current_time - group_data['start_time'] > self.media_group_max_wait:
-                    # 超过最大等待时间，强制开始下载
-                    logger.warning(f"媒体组 {media_group_id} 等待新消息超时，开始下载")
-                    await self._start_media_group_download(media_group_id)
-                else:
-                    # 开始下载
-                    await self._start_media_group_download(media_group_id)
-                    
-            elif group_data['status'] == 'downloading':
-                # 下载阶段：检查下载进度
-                download_time = current_time - group_data['download_start_time']
-                if download_time > self.download_timeout:
-                    logger.error(f"媒体组 {media_group_id} 下载超时（{download_time:.1f}秒），放弃处理")
-                    del self.media_groups[media_group_id]
-                else:
-                    # 继续等待下载完成
-                    logger.info(f"媒体组 {media_group_id} 正在下载中，已用时 {download_time:.1f} 秒")
-                    group_data['timer'] = asyncio.create_task(
-                        self._process_media_group_after_timeout(media_group_id)
-                    )
+            # 收集结束，之后到达的同组消息不再加入本组
+            group_data.status = 'downloading'
+            try:
+                await asyncio.wait_for(self._start_media_group_download(media_group_id, group_data), self.download_timeout)
+            except asyncio.TimeoutError:
+                logger.error("媒体组 %s 下载超时（%s秒），放弃处理", media_group_id, self.download_timeout)
                 
         except asyncio.CancelledError:
-            logger.info(f"媒体组 {media_group_id} 的处理被取消")
+            logger.info("媒体组 %s 的处理被取消", media_group_id)
         except Exception as e:
-            logger.error(f"处理媒体组 {media_group_id} 时出错: {e}")
-            # 清理媒体组缓存
-            if media_group_id in self.media_groups:
+            logger.error("处理媒体组 %s 时出错: %s", media_group_id, e)
+        finally:
+            # 清理媒体组缓存（迟到的消息可能已创建了新的同 ID 媒体组，不能误删）
+            if self.media_groups.get(media_group_id) is group_data:
                 del self.media_groups[media_group_id]
     
-    async def _start_media_group_download(self, media_group_id: str):
+    async def _start_media_group_download(self, media_group_id: int, group_data: MediaGroupState):
         """开始媒体组下载 (复用原有逻辑)"""
+        # 已下载完成、尚未交给转发队列的文件
+        finished_files = []
         try:
-            if media_group_id not in self.media_groups:
-                return
-                
-            group_data = self.media_groups[media_group_id]
-            messages = group_data['messages']
+            messages = group_data.messages
             
-            # 更新状态为下载中
-            group_data['status'] = 'downloading'
-            group_data['download_start_time'] = asyncio.get_event_loop().time()
+            # 记录下载开始时间
+            group_data.download_start_time = self._loop.time()
             
-            logger.info(f"开始下载媒体组 {media_group_id}，包含 {len(messages)} 条消息")
+            logger.info("开始下载媒体组 %s，包含 %s 条消息", media_group_id, len(messages))
             
-            # 添加智能随机延迟
-            await self.smart_delay("normal")
+            # 消息密集时按随机间隔错开下载
+            await self._wait_live_slot()
             
-            # 设置下载进度监控
-            group_data['timer'] = asyncio.create_task(
-                self._process_media_group_after_timeout(media_group_id)
-            )
+            # 并发下载所有媒体文件（与批量转发共用下载并发限制）
+            media_messages = group_data.media_messages
+            total_messages = len(media_messages)
             
-            # 下载所有媒体文件
+            async def download_one(i: int, message: Message) -> list:
+                async with self._download_semaphore:
+                    logger.info("📥 下载媒体组 %s 第 %s/%s 个文件", media_group_id, i, total_messages)
+                    downloaded_files = await self.media_downloader.download_media(
+                        message, self.client, in_memory=True, uploaded_media=self.bot_handler.get_uploaded_media
+                    )
+                finished_files.extend(downloaded_files)
+                logger.info("✅ 完成下载第 %s/%s 个文件，共获得 %s 个文件", i, total_messages, len(downloaded_files))
+                return downloaded_files
+            
+            logger.info("📥 开始下载媒体组 %s 的所有文件...", media_group_id)
+            # 媒体组需要作为一个相册一次发送，不能逐个文件边下载边转发；
+            # 单条消息只包含一个媒体，下载与上传的重叠在消息之间进行（见 _forward_messages_concurrently）
+            results = await asyncio.gather(
+                *(download_one(i, message) for i, message in enumerate(media_messages, 1)),
+                return_exceptions=True
+            )
+            # gather 按提交顺序返回结果，保持媒体组内文件顺序；单个文件失败不影响其余文件
             all_downloaded_files = []
-            total_messages = len(messages)
-            
-            logger.info(f"📥 开始下载媒体组 {media_group_id} 的所有文件...")
-            for i, message in enumerate(messages, 1):
-                if self.bot_handler.has_media(message):
-                    logger.info(f"📥 下载媒体组 {media_group_id} 第 {i}/{total_messages} 个文件")
-                    downloaded_files = await self.media_downloader.download_media(message, self.client)
-                    all_downloaded_files.extend(downloaded_files)
-                    logger.info(f"✅ 完成下载第 {i}/{total_messages} 个文件，共获得 {len(downloaded_files)} 个文件")
-            
-            logger.info(f"📥 媒体组 {media_group_id} 所有文件下载完成，共 {len(all_downloaded_files)} 个文件")
+            for message, result in zip(media_messages, results):
+                if isinstance(result, Exception):
+                    logger.error("❌ 媒体组 %s 中消息 %s 下载失败: %s", media_group_id, message.id, result)
+                else:
+                    all_downloaded_files.extend(result)
             
-            # 取消进度监控定时器
-            if group_data['timer']:
-                group_data['timer'].cancel()
+            logger.info("📥 媒体组 %s 所有文件下载完成，共 %s 个文件", media_group_id, len(all_downloaded_files))
             
             # 更新状态为完成
-            group_data['status'] = 'completed'
+            group_data.status = 'completed'
             
             if all_downloaded_files:
-                # 找到包含文案的消息，如果没有则使用第一条消息
-                main_message = messages[0]
-                for message in messages:
-                    if message.text:
-                        main_message = message
-                        logger.info(f"📝 使用消息 {message.id} 的文案作为媒体组说明")
-                        break
+                # 使用收集时记录的带文案消息，如果没有则使用第一条消息
+                main_message = group_data.main_message or messages[0]
+                if main_message.text:
+                    logger.info("📝 使用消息 %s 的文案作为媒体组说明", main_message.id)
                 
-                logger.info(f"📤 开始转发媒体组 {media_group_id} 到目标频道...")
-                
-                try:
-                    await self.bot_handler.forward_message(main_message, all_downloaded_files, self.client)
-                    
-                    download_time = asyncio.get_event_loop().time() - group_data['download_start_time']
-                    logger.info(f"🎉 成功转发媒体组 {media_group_id} 到目标频道！包含 {len(all_downloaded_files)} 个文件，总耗时 {download_time:.1f} 秒")
-                    
-                    # 自动清理已成功发布的文件
-                    logger.info(f"🧹 开始清理媒体组 {media_group_id} 的本地文件...")
-                    await self._cleanup_files(all_downloaded_files)
-                    logger.info(f"🧹 媒体组 {media_group_id} 文件清理完成")
-                    
-                except Exception as e:
-                    logger.error(f"❌ 转发媒体组 {media_group_id} 失败: {e}")
-                    logger.info(f"🧹 转发失败，清理本地文件...")
-                    await self._cleanup_files(all_downloaded_files)
-                    raise
+                logger.info("📤 媒体组 %s 已加入转发队列，共 %s 个文件", media_group_id, len(all_downloaded_files))
+                await self._forward_queue.put((main_message, all_downloaded_files, f"媒体组 {media_group_id}"))
+                # 文件已交给转发协程，由其负责清理
+                finished_files.clear()
             else:
-                logger.warning(f"⚠️ 媒体组 {media_group_id} 没有可下载的媒体文件")
-            
-            # 清理媒体组缓存
-            del self.media_groups[media_group_id]
+                logger.warning("⚠️ 媒体组 %s 没有可下载的媒体文件", media_group_id)
             
         except Exception as e:
-            logger.error(f"下载媒体组 {media_group_id} 时出错: {e}")
-            # 清理媒体组缓存
-            if media_group_id in self.media_groups:
-                del self.media_groups[media_group_id]
+            logger.error("下载媒体组 %s 时出错: %s", media_group_id, e)
+        finally:
+            # 下载被取消（如超时）或出错时，未交给转发队列的文件释放内存并删除本地文件
+            if finished_files:
+                logger.info("🧹 清理媒体组 %s 未转发的 %s 个文件", media_group_id, len(finished_files))
+                self._schedule_cleanup(finished_files)
+    
+    async def _forward_worker(self):
+        """转发协程：从队列取出已下载的消息发送到目标频道"""
+        while True:
+            message, downloaded_files, label = await self._forward_queue.get()
+            try:
+                await self._forward_downloaded(message, downloaded_files)
+            except Exception as e:
+                logger.error("❌ 转发%s %s 失败: %s", label, message.id, e)
+                if downloaded_files:
+                    logger.info("🧹 转发失败，清理本地文件...")
+                    await self._cleanup_files(downloaded_files)
+            finally:
+                self._forward_queue.task_done()
+    
+    def _forward_worker_count(self) -> int:
+        """转发协程数量；合并相册时每条等待合并的消息占用一个协程，至少要能凑满一个相册"""
+        if self.config.album_batch_enabled:
+            return max(self.config.forward_concurrency, self.bot_handler.ALBUM_MAX_SIZE)
+        return self.config.forward_concurrency
+    
+    def _start_forward_workers(self):
+        """启动转发协程"""
+        self._forward_workers = [
+            asyncio.create_task(self._forward_worker())
+            for _ in range(self._forward_worker_count())
+        ]
+    
+    async def _stop_forward_workers(self):
+        """等待队列中的消息转发完毕后停止转发协程"""
+        if not self._forward_workers:
+            return
+        
+        if not self._forward_queue.empty():
+            logger.info("⏳ 等待 %s 条已下载的消息转发完成...", self._forward_queue.qsize())
+        # 转发协程被强制取消时队列不会再清空，不再等待
+        queue_drained = asyncio.ensure_future(self._forward_queue.join())
+        try:
+            await asyncio.wait({queue_drained, *self._forward_workers}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            queue_drained.cancel()
+        
+        for worker in self._forward_workers:
+            worker.cancel()
+        await asyncio.gather(*self._forward_workers, return_exceptions=True)
+        self._forward_workers = []
     
     async def _cleanup_files(self, file_infos: list):
         """清理已成功发布的文件 (复用原有逻辑)"""
-        import os
-        for file_info in file_infos:
+        # 内存中的文件（path 为 None）无需删除，只归还内存额度
+        self.media_downloader.release_memory(file_infos)
+        paths = [file_info['path'] for file_info in file_infos if file_info['path'] is not None]
+        if not paths:
+            return
+        # 所有删除操作在一个线程任务中完成，避免阻塞事件循环
+        await asyncio.to_thread(self._remove_files, paths)
+    
+    def _schedule_cleanup(self, file_infos: list):
+        """把文件交给后台清理协程删除，不等待删除完成"""
+        self.media_downloader.release_memory(file_infos)
+        paths = [file_info['path'] for file_info in file_infos if file_info['path'] is not None]
+        if not paths:
+            return
+        self._cleanup_queue.put_nowait(paths)
+        if self._cleanup_worker is None:
+            self._cleanup_worker = asyncio.create_task(self._run_cleanup_worker())
+    
+    async def _run_cleanup_worker(self):
+        """清理协程：把队列中积压的文件合并为一次线程调用删除"""
+        while True:
+            batches = [await self._cleanup_queue.get()]
+            while not self._cleanup_queue.empty():
+                batches.append(self._cleanup_queue.get_nowait())
             try:
-                # 处理新的文件格式 {'path': Path, 'type': str}
-                if isinstance(file_info, dict):
-                    file_path = file_info['path']
-                else:
-                    # 向后兼容旧格式
-                    file_path = file_info
-                    
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.info(f"已清理文件: {file_path}")
+                await asyncio.to_thread(self._remove_files, [path for paths in batches for path in paths])
+            finally:
+                for _ in batches:
+                    self._cleanup_queue.task_done()
+    
+    async def _stop_cleanup_worker(self):
+        """等待待删除的文件清理完毕后停止清理协程"""
+        if self._cleanup_worker is None:
+            return
+        await self._cleanup_queue.join()
+        self._cleanup_worker.cancel()
+        await asyncio.gather(self._cleanup_worker, return_exceptions=True)
+        self._cleanup_worker = None
+    
+    @staticmethod
+    def _remove_files(paths: list):
+        """同步删除文件，在线程中执行"""
+        for file_path in paths:
+            try:
+                os.remove(file_path)
+                logger.debug("已清理文件: %s", file_path)
+            except FileNotFoundError:
+                pass
             except Exception as e:
-                logger.error(f"清理文件 {file_info} 失败: {e}")
+                logger.error("清理文件 %s 失败: %s", file_path, e)
+    
+    async def _download_for_forward(self, message: Message) -> Optional[list]:
+        """下载消息中的媒体文件；纯文本消息返回空列表，没有可下载的媒体时返回 None"""
+        if not self.bot_handler.has_media(message):
+            return []
+        
+        downloaded_files = await self.media_downloader.download_media(
+            message, self.client, in_memory=True, uploaded_media=self.bot_handler.get_uploaded_media
+        )
+        if not downloaded_files:
+            logger.warning("⚠️ 消息 %s 没有可下载的媒体文件", message.id)
+            return None
+        return downloaded_files
+    
+    async def _forward_downloaded(self, message: Message, downloaded_files: list) -> bool:
+        """转发已下载的消息到目标频道，成功后清理本地文件"""
+        for attempt in range(self.FLOOD_WAIT_RETRIES + 1):
+            try:
+                async with self._forward_limiter.acquire():
+                    if downloaded_files:
+                        # 转发消息到目标频道
+                        await self.bot_handler.forward_message(message, downloaded_files, self.client)
+                    else:
+                        # 转发纯文本消息
+                        await self.bot_handler.forward_text_message(message, self.client)
+                break
+            except FloodWaitError as e:
+                # 超过自动等待阈值的 FloodWait：暂停所有转发，按服务器要求的时间等待后重试
+                if attempt == self.FLOOD_WAIT_RETRIES:
+                    raise
+                logger.warning("⏳ 转发消息 %s 触发 FloodWait，所有转发暂停 %s 秒后重试", message.id, e.seconds)
+                self._forward_limiter.suspend(e.seconds)
+        
+        if downloaded_files:
+            logger.info("✅ 成功转发媒体消息 %s", message.id)
+            # 自动清理已成功发布的文件（后台进行，转发协程直接处理下一条）
+            self._schedule_cleanup(downloaded_files)
+        else:
+            logger.info("✅ 成功转发文本消息 %s", message.id)
+        
+        return True
+    
+    async def _forward_messages_concurrently(self, messages: AsyncIterator[Message], label: str,
+                                             progress: ProgressCallback = None) -> Tuple[int, int]:
+        """边获取边转发一批消息，返回 (获取到的消息数, 成功数量)
+        
+        获取协程把消息放入有界的待处理队列，下载协程取出下载后放入上传队列，
+        由上传协程转发；第一条消息获取到即开始下载，下载与上传重叠进行。
+        """
+        workers = self.config.forward_concurrency
+        found = 0
+        done = 0
+        success = 0
+        
+        pending = asyncio.Queue(maxsize=self.HISTORY_PREFETCH_SIZE)
+        # 上传队列有界，上传跟不上时下载协程等待，避免积压过多已下载文件
+        uploads = asyncio.Queue(maxsize=workers)
+        
+        async def produce():
+            nonlocal found
+            try:
+                async for message in messages:
+                    found += 1
+                    await pending.put((found, message))
+            except Exception as e:
+                # 获取中途出错时，已获取的消息照常处理
+                logger.error(f"❌ 获取{label}时出错: {e}")
+            finally:
+                for _ in range(workers):
+                    await pending.put(None)
+        
+        async def finish(ok: bool):
+            nonlocal done, success
+            done += 1
+            if ok:
+                success += 1
+            if progress:
+                await progress(done, found)
+        
+        async def download_worker():
+            while True:
+                item = await pending.get()
+                if item is None:
+                    return
+                i, message = item
+                try:
+                    # 与媒体组下载共用下载并发限制；转发频率由共享的速率限制器控制
+                    async with self._download_semaphore:
+                        logger.info("📥 正在处理第 %s 条%s (ID: %s, 时间: %s)", i, label, message.id, message.date)
+                        downloaded_files = await self._download_for_forward(message)
+                except Exception as e:
+                    logger.error("❌ 处理%s %s 时出错: %s", label, message.id, e)
+                    downloaded_files = None
+                
+                if downloaded_files is None:
+                    await finish(False)
+                else:
+                    await uploads.put((message, downloaded_files))
+        
+        async def upload_worker():
+            while True:
+                message, downloaded_files = await uploads.get()
+                try:
+                    try:
+                        ok = await self._forward_downloaded(message, downloaded_files)
+                    except Exception as e:
+                        logger.error("❌ 处理%s %s 时出错: %s", label, message.id, e)
+                        await self._cleanup_files(downloaded_files)
+                        ok = False
+                    await finish(ok)
+                finally:
+                    uploads.task_done()
+        
+        uploaders = [asyncio.create_task(upload_worker()) for _ in range(self._forward_worker_count())]
+        try:
+            await asyncio.gather(produce(), *(download_worker() for _ in range(workers)))
+            await uploads.join()
+        finally:
+            for uploader in uploaders:
+                uploader.cancel()
+            await asyncio.gather(*uploaders, return_exceptions=True)
+        
+        return found, success
+    
+    def _is_content_message(self, message: Message) -> bool:
+        """是否为有内容（媒体或文本）的消息"""
+        return self.bot_handler.has_media(message) or bool(message.text)
+    
+    def _get_cached_messages(self, entity, limit: int) -> Optional[list]:
+        """从最近消息缓存中获取指定频道的最新消息，缓存不足时返回 None"""
+        peer_id = utils.get_peer_id(entity)
+        messages = []
+        # 缓存按接收顺序保存，倒序遍历得到最新的消息
+        for message in reversed(self._recent_messages):
+            if message.chat_id == peer_id and self._is_content_message(message):
+                messages.append(message)
+                if len(messages) >= limit:
+                    logger.info(f"📦 使用缓存中的 {len(messages)} 条最新消息")
+                    return messages
+        return None
+    
+    async def _iter_content_messages(self, entity, limit: int, offset_date: Optional[datetime] = None,
+                                     min_date: Optional[datetime] = None) -> AsyncIterator[Message]:
+        """从新到旧逐条获取频道中最多 limit 条有内容的消息
+        
+        未指定日期时优先使用最近消息缓存；指定 min_date 时只扫描 offset_date 之前、
+        min_date 之后的消息，遇到更早的消息即停止。
+        """
+        if offset_date is None and min_date is None:
+            messages = self._get_cached_messages(entity, limit)
+            if messages is not None:
+                for message in messages:
+                    yield message
+                return
+        
+        count = 0
+        async for message in self.client.iter_messages(
+            entity,
+            # 有时间下限时由日期决定何时停止，不限制扫描数量
+            limit=None if min_date else limit,
+            offset_date=offset_date
+        ):
+            if min_date and message.date < min_date:
+                return
+            
+            if self._is_content_message(message):
+                yield message
+                count += 1
+                if count >= limit:
+                    return
+    
+    async def _process_batch(self, messages: AsyncIterator[Message], label: str, progress: ProgressCallback = None) -> int:
+        """边获取边转发一批消息并记录结果，返回成功数量"""
+        logger.info(f"📋 开始获取并处理{label}...")
+        
+        found, success_count = await self._forward_messages_concurrently(messages, label, progress)
+        if not found:
+            logger.warning(f"❌ 没有找到符合条件的{label}")
+            return 0
+        
+        logger.info(f"🎉 {label}处理完成！成功处理: {success_count}/{found} 条")
+        return success_count
     
     async def download_history_messages(self, limit: int = 100, offset_days: int = 0):
         """下载历史消息 - 支持按时间范围和数量限制"""
         try:
-            from datetime import datetime, timedelta
-            
             logger.info(f"🔄 开始下载最近 {limit} 条历史消息（{offset_days}天前开始）...")
             
             # 获取源频道实体
-            source_entity = await self.client.get_entity(self.config.source_channel_id)
+            source_entity = await self._get_channel_entity(self.config.source_channel_id)
             
             # 计算开始时间
             if offset_days > 0:
@@ -761,57 +1184,8 @@ class TelegramUserClient:
             else:
                 offset_date = None
             
-            # 获取历史消息
-            messages = []
-            async for message in self.client.iter_messages(
-                source_entity, 
-                limit=limit,
-                offset_date=offset_date
-            ):
-                if self.bot_handler.has_media(message) or message.text:
-                    messages.append(message)
-            
-            if not messages:
-                logger.warning("❌ 没有找到符合条件的历史消息")
-                return 0
-            
-            logger.info(f"📋 找到 {len(messages)} 条历史消息，开始处理...")
-            
-            success_count = 0
-            for i, message in enumerate(messages, 1):
-                try:
-                    logger.info(f"📥 正在处理第 {i}/{len(messages)} 条历史消息 (ID: {message.id})...")
-                    
-                    # 检查消息是否包含媒体
-                    if self.bot_handler.has_media(message):
-                        # 下载媒体文件
-                        downloaded_files = await self.media_downloader.download_media(message, self.client)
-                        
-                        if downloaded_files:
-                            # 转发消息到目标频道
-                            await self.bot_handler.forward_message(message, downloaded_files, self.client)
-                            success_count += 1
-                            logger.info(f"✅ 成功转发历史媒体消息 {message.id}")
-                            
-                            # 自动清理已成功发布的文件
-                            await self._cleanup_files(downloaded_files)
-                        else:
-                            logger.warning(f"⚠️ 历史消息 {message.id} 没有可下载的媒体文件")
-                    else:
-                        # 转发纯文本消息
-                        await self.bot_handler.forward_text_message(message, self.client)
-                        success_count += 1
-                        logger.info(f"✅ 成功转发历史文本消息 {message.id}")
-                    
-                    # 添加智能延迟避免频率限制
-                    await self.smart_delay("short")
-                        
-                except Exception as e:
-                    logger.error(f"❌ 处理历史消息 {message.id} 时出错: {e}")
-                    continue
-            
-            logger.info(f"🎉 历史消息处理完成！成功处理: {success_count}/{len(messages)} 条消息")
-            return success_count
+            messages = self._iter_content_messages(source_entity, limit, offset_date=offset_date)
+            return await self._process_batch(messages, "历史消息")
             
         except Exception as e:
             logger.error(f"❌ 下载历史消息时出错: {e}")
@@ -819,24 +1193,51 @@ class TelegramUserClient:
     
     async def manual_download_command(self, count: int = 5):
         """手动下载命令 - 随机下载N个历史消息"""
-        return await self.download_history_messages(limit=count)
+        try:
+            source_entity = await self._get_channel_entity(self.config.source_channel_id)
+            
+            # 蓄水池抽样：在最近的消息中均匀抽取，内存只保留 count 条
+            reservoir = []
+            seen = 0
+            async for message in self.client.iter_messages(source_entity, limit=self.RANDOM_SAMPLE_POOL):
+                if not self._is_content_message(message):
+                    continue
+                
+                seen += 1
+                if len(reservoir) < count:
+                    reservoir.append(message)
+                else:
+                    j = random.randrange(seen)
+                    if j < count:
+                        reservoir[j] = message
+            
+            if reservoir:
+                logger.info(f"🎲 从 {seen} 条消息中随机抽取 {len(reservoir)} 条")
+            return await self._process_batch(_iter_list(reservoir), "随机消息")
+            
+        except Exception as e:
+            logger.error(f"❌ 随机下载历史消息时出错: {e}")
+            return 0
     
-    async def command_download_by_channel_date(self, channel_id: str, days_ago: int = 0, limit: int = 50):
+    async def command_download_by_channel_date(self, channel_id: str, days_ago: int = 0, limit: int = 50,
+                                               progress: ProgressCallback = None):
         """手动命令：下载指定频道指定日期的消息"""
         try:
             logger.info(f"🎮 手动下载命令：频道 {channel_id}，{days_ago}天前的消息，限制 {limit} 条")
             
             # 获取频道实体
             try:
-                entity = await self.client.get_entity(channel_id)
+                entity = await self._get_channel_entity(channel_id)
                 logger.info(f"✅ 已连接到频道: {getattr(entity, 'title', 'Unknown')}")
             except Exception as e:
                 logger.error(f"❌ 无法连接到频道 {channel_id}: {e}")
                 return 0
             
-            # 计算日期范围
+            # 计算日期范围（本地时间当天 0 点到第二天 0 点）
             if days_ago > 0:
-                target_date = datetime.now() - timedelta(days=days_ago)
+                target_date = (datetime.now() - timedelta(days=days_ago)).replace(
+                    hour=0, minute=0, second=0, microsecond=0
+                ).astimezone()
                 end_date = target_date + timedelta(days=1)  # 第二天开始
                 logger.info(f"📅 下载日期范围: {target_date.strftime('%Y-%m-%d')} 的消息")
             else:
@@ -844,60 +1245,20 @@ class TelegramUserClient:
                 end_date = None
                 logger.info(f"📅 下载最新的 {limit} 条消息")
             
-            # 获取消息
-            messages = []
-            async for message in self.client.iter_messages(
-                entity,
-                limit=limit * 2,  # 多获取一些，因为要过滤
-                offset_date=end_date if end_date else None
-            ):
-                # 如果指定了日期，检查消息日期
-                if target_date:
-                    if message.date.date() != target_date.date():
-                        continue
-                
-                # 只处理有内容的消息
-                if self.bot_handler.has_media(message) or message.text:
-                    messages.append(message)
-                    if len(messages) >= limit:
-                        break
-            
-            if not messages:
-                logger.warning(f"❌ 在频道 {channel_id} 中没有找到符合条件的消息")
-                return 0
-            
-            logger.info(f"📋 找到 {len(messages)} 条符合条件的消息，开始处理...")
-            
-            # 添加批量操作延迟
-            await self.smart_delay("batch")
-            
-            success_count = 0
-            for i, message in enumerate(messages, 1):
-                try:
-                    logger.info(f"📥 处理第 {i}/{len(messages)} 条消息 (ID: {message.id}, 时间: {message.date})")
-                    
-                    # 智能延迟
-                    await self.smart_delay("short")
-                    
-                    # 处理消息
-                    if self.bot_handler.has_media(message):
-                        downloaded_files = await self.media_downloader.download_media(message, self.client)
-                        if downloaded_files:
-                            await self.bot_handler.forward_message(message, downloaded_files, self.client)
-                            await self._cleanup_files(downloaded_files)
-                            success_count += 1
-                            logger.info(f"✅ 成功转发媒体消息 {message.id}")
-                    else:
-                        await self.bot_handler.forward_text_message(message, self.client)
-                        success_count += 1
-                        logger.info(f"✅ 成功转发文本消息 {message.id}")
-                        
-                except Exception as e:
-                    logger.error(f"❌ 处理消息 {message.id} 时出错: {e}")
-                    continue
-            
-            logger.info(f"🎉 手动下载完成！成功处理: {success_count}/{len(messages)} 条消息")
-            return success_count
+            async def paced_messages():
+                # 找到第一条消息后再执行批量操作延迟，没有消息时无需等待
+                delayed = False
+                async for message in self._iter_content_messages(
+                    entity, limit,
+                    offset_date=end_date,
+                    min_date=target_date
+                ):
+                    if not delayed:
+                        await self.smart_delay("batch")
+                        delayed = True
+                    yield message
+            
+            return await self._process_batch(paced_messages(), "消息", progress)
             
         except Exception as e:
             logger.error(f"❌ 手动下载命令执行出错: {e}")
@@ -1061,6 +1422,9 @@ class TelegramUserClient:
             # 设置事件处理器
             await self.setup_handlers()
             
+            # 启动转发协程
+            self._start_forward_workers()
+            
             # 启动消息队列处理器（如果启用）
             if self.config.queue_enabled:
                 await self.message_queue.start_processing(self.bot_handler, self.client)
@@ -1095,8 +1459,15 @@ class TelegramUserClient:
             logger.info("🤖 程序将在后台持续运行...")
             logger.info("💬 私聊发送命令控制: /help, /status, /download, /queue")
             
-            # 运行客户端直到断开连接（纯后台模式）
-            await self.client.run_until_disconnected()
+            # 运行客户端直到断开连接或收到退出信号（纯后台模式）
+            shutdown_waiter = asyncio.ensure_future(self._shutdown_event.wait())
+            try:
+                await asyncio.wait(
+                    {self.client.disconnected, shutdown_waiter},
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                shutdown_waiter.cancel()
             
         except asyncio.CancelledError:
             logger.info("用户客户端被取消")
@@ -1105,10 +1476,26 @@ class TelegramUserClient:
             logger.error(f"用户客户端运行出错: {e}")
             raise
         finally:
+            # 不再接收新消息，只处理已经开始的消息
+            self._shutdown_event.set()
+            if self._new_message_handler is not None:
+                self.client.remove_event_handler(self._new_message_handler)
+                self._new_message_handler = None
+            
+            # 等待正在处理的消息和媒体组完成（客户端此时仍保持连接）
+            if self._inflight:
+                logger.info(f"⏳ 等待 {len(self._inflight)} 个正在处理的消息任务完成...")
+                await asyncio.gather(*self._inflight, return_exceptions=True)
+            # 待合并的相册立即发送，之后加入的媒体也不再等待合并窗口
+            await self.bot_handler.flush_albums(self.client)
+            await self._stop_forward_workers()
+            await self._stop_cleanup_worker()
+            
             # 停止消息队列处理器
             if self.config.queue_enabled:
                 await self.message_queue.stop_processing()
                 logger.info("🛑 消息队列处理器已停止")
+            self.message_queue.close()
             
             # 确保客户端被正确关闭
             if self.client and self.client.is_connected():
@@ -1122,23 +1509,38 @@ class TelegramUserClient:
 async def main():
     """主函数"""
     user_client = TelegramUserClient()
+    
+    # 在事件循环内处理退出信号，让进行中的下载/转发完成后再退出
+    if sys.platform != 'win32':
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, user_client.request_shutdown, signum)
+    
     await user_client.run()
 
 
 def handle_signal(signum, frame):
-    """信号处理"""
+    """信号处理（不支持 loop.add_signal_handler 的平台）"""
     logger.info(f"收到信号 {signum}，准备退出...")
     sys.exit(0)
 
 
 if __name__ == "__main__":
-    # 注册信号处理器
-    signal.signal(signal.SIGINT, handle_signal)
-    signal.signal(signal.SIGTERM, handle_signal)
+    # Windows 上事件循环不支持信号处理器，退回到直接退出
+    if sys.platform == 'win32':
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
     
     try:
-        # 运行用户客户端
-        asyncio.run(main())
+        # 运行用户客户端（Python 3.11+ 使用 asyncio.Runner 统一管理事件循环生命周期）
+        loop_factory = uvloop.new_event_loop if uvloop and sys.platform != 'win32' else None
+        if hasattr(asyncio, 'Runner'):
+            with asyncio.Runner(loop_factory=loop_factory) as runner:
+                runner.run(main())
+        else:
+            if loop_factory:
+                uvloop.install()
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("用户客户端已停止")
     except asyncio.CancelledError:
@@ -2,12 +2,13 @@
 媒体文件下载模块 (Telethon User API版本)
 """
 
-import asyncio
 import logging
+import os
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Any, Callable, List, Optional, Union
 from datetime import datetime
 
+import aiofiles
 from telethon import TelegramClient
 from telethon.tl.types import Message, MessageMediaPhoto, MessageMediaDocument
 from telethon.errors import RPCError
@@ -20,25 +21,54 @@ logger = logging.getLogger(__name__)
 class MediaDownloader:
     """媒体文件下载器 (使用 Telethon User API)"""
     
+    # MIME 主类型到媒体类型的映射
+    _MIME_MAJOR_TYPES = {
+        'image': 'photo',
+        'video': 'video',
+        'audio': 'audio',
+    }
+    
+    # 文档没有文件名时，各媒体类型使用的默认扩展名
+    _DEFAULT_EXTENSIONS = {
+        'photo': 'jpg',
+        'video': 'mp4',
+        'audio': 'mp3',
+        'animation': 'gif',
+        'document': 'bin'
+    }
+    
+    # 流式下载文档时，累积到此大小再提交一次写盘
+    _WRITE_BATCH_SIZE = 4 * 1024 * 1024
+    
     def __init__(self, config: Config):
         self.config = config
-        self.download_path = Path(config.download_path)
-        self.download_path.mkdir(exist_ok=True)
+        # 下载目录已在 Config 校验时创建
+        self.download_path = config.download_dir
+        # 当前保存在内存中、尚未转发完成的文件总字节数
+        self._memory_in_use = 0
     
-    async def download_media(self, message: Message, client: TelegramClient) -> List[dict]:
-        """下载消息中的媒体文件，返回文件路径和类型信息"""
+    async def download_media(self, message: Message, client: TelegramClient, in_memory: bool = False,
+                             uploaded_media: Optional[Callable[[str], Any]] = None) -> List[dict]:
+        """下载消息中的媒体文件，返回文件路径和类型信息
+        
+        每个文件的 path 为 Path 对象；in_memory 为 True 时，不超过 IN_MEMORY_DOWNLOAD_LIMIT
+        的文件直接下载到内存，返回的信息中 path 为 None，data 为文件内容。内存中的文件合计
+        超过 IN_MEMORY_TOTAL_LIMIT 时改为下载到磁盘；转发完成后需调用 release_memory 归还额度。
+        uploaded_media 按源消息标识查询已上传过的媒体，命中时不下载，返回的信息中 path 为 None，
+        media 为可直接发送的媒体对象。
+        """
         downloaded_files = []
         
         try:
             # 检查消息是否包含媒体
             if not self._has_media(message):
-                logger.info(f"消息 {message.id} 不包含媒体文件")
+                logger.info("消息 %s 不包含媒体文件", message.id)
                 return downloaded_files
             
             # 获取所有媒体文件信息
             media_info_list = self._get_all_media_info(message)
             if not media_info_list:
-                logger.warning(f"无法获取消息 {message.id} 的媒体信息")
+                logger.warning("无法获取消息 %s 的媒体信息", message.id)
                 return downloaded_files
             
             # 下载所有媒体文件
@@ -48,38 +78,96 @@ class MediaDownloader:
                 max_size_gb = self.config.max_file_size / (1024 * 1024 * 1024)
                 
                 if media_info['file_size'] > self.config.max_file_size:
-                    logger.warning(f"⚠️ 文件 {media_info['file_name']} 超过配置的大小限制 ({file_size_mb:.1f}MB > {max_size_gb:.1f}GB)，跳过下载")
+                    logger.warning("⚠️ 文件 %s 超过配置的大小限制 (%.1fMB > %.1fGB)，跳过下载", media_info['file_name'], file_size_mb, max_size_gb)
                     continue
                 
                 # User API 支持 2GB 文件，无需特殊警告
                 if media_info['file_size'] > 1024 * 1024 * 1024:  # 1GB
-                    logger.info(f"📥 准备下载大文件: {media_info['file_name']} ({file_size_mb:.1f}MB)")
+                    logger.info("📥 准备下载大文件: %s (%.1fMB)", media_info['file_name'], file_size_mb)
                 
                 # 生成文件名
                 file_name = self._generate_file_name(message, media_info, i)
+                # 源消息标识，用于复用已上传的媒体
+                source_key = f"{message.chat_id}:{message.id}:{i}"
+                
+                # 已上传过的媒体直接复用，跳过下载
+                cached_media = uploaded_media(source_key) if uploaded_media else None
+                if cached_media is not None:
+                    logger.info("复用已上传的媒体，跳过下载: %s", file_name)
+                    downloaded_files.append({
+                        'path': None,
+                        'media': cached_media,
+                        'file_name': file_name,
+                        'type': media_info['media_type'],
+                        'size': media_info['file_size'],
+                        'source_key': source_key
+                    })
+                    continue
+                
+                # 小文件直接下载到内存，省去写盘、读盘和删除；内存额度用完时照常落盘
+                if (in_memory and 0 < media_info['file_size'] <= self.config.in_memory_download_limit
+                        and self._reserve_memory(media_info['file_size'])):
+                    logger.info("开始下载文件到内存: %s", file_name)
+                    try:
+                        data = await self._download_file(message, media_info, bytes, client)
+                    finally:
+                        self._memory_in_use -= media_info['file_size']
+                    if data:
+                        self._memory_in_use += len(data)
+                        downloaded_files.append({
+                            'path': None,
+                            'data': data,
+                            'file_name': file_name,
+                            'type': media_info['media_type'],
+                            'size': len(data),
+                            'source_key': source_key
+                        })
+                        logger.info("成功下载文件到内存: %s (%.1fMB)", file_name, len(data) / (1024 * 1024))
+                    else:
+                        logger.error("文件下载失败或文件为空: %s", file_name)
+                    continue
+                
                 file_path = self.download_path / file_name
                 
                 # 下载文件
-                logger.info(f"开始下载文件: {file_name}")
+                logger.info("开始下载文件: %s", file_name)
                 await self._download_file(message, media_info, file_path, client)
                 
-                if file_path.exists() and file_path.stat().st_size > 0:
+                file_size = file_path.stat().st_size if file_path.exists() else 0
+                if file_size > 0:
                     downloaded_files.append({
                         'path': file_path,
-                        'type': media_info['media_type']
+                        'type': media_info['media_type'],
+                        'size': file_size,
+                        'source_key': source_key
                     })
-                    logger.info(f"成功下载文件: {file_path} ({file_size_mb:.1f}MB)")
+                    logger.info("成功下载文件: %s (%.1fMB)", file_path, file_size_mb)
                 else:
-                    logger.error(f"文件下载失败或文件为空: {file_path}")
+                    logger.error("文件下载失败或文件为空: %s", file_path)
             
         except Exception as e:
-            logger.error(f"下载媒体文件时出错: {e}")
+            logger.error("下载媒体文件时出错: %s", e)
         
         return downloaded_files
     
+    def _reserve_memory(self, size: int) -> bool:
+        """为下载到内存的文件预留额度，超出 IN_MEMORY_TOTAL_LIMIT 时返回 False"""
+        if self._memory_in_use + size > self.config.in_memory_total_limit:
+            logger.debug("内存额度不足 (%s/%s 字节)，文件改为下载到磁盘", self._memory_in_use, self.config.in_memory_total_limit)
+            return False
+        self._memory_in_use += size
+        return True
+    
+    def release_memory(self, file_infos: list):
+        """释放已转发完成（或放弃转发）的内存文件，归还内存额度"""
+        for file_info in file_infos:
+            data = file_info.pop('data', None)
+            if data is not None:
+                self._memory_in_use -= len(data)
+    
     def _has_media(self, message: Message) -> bool:
         """检查消息是否包含媒体"""
-        return message.media is not None and not isinstance(message.media, type(None))
+        return message.media is not None
     
     def _get_all_media_info(self, message: Message) -> List[dict]:
         """获取所有媒体文件信息"""
@@ -123,16 +211,13 @@ class MediaDownloader:
     
     def _get_media_type_from_mime(self, mime_type: str) -> str:
         """根据 MIME 类型判断媒体类型"""
-        if mime_type.startswith('image/'):
-            return 'photo'
-        elif mime_type.startswith('video/'):
-            return 'video'
-        elif mime_type.startswith('audio/'):
-            return 'audio'
-        elif 'gif' in mime_type.lower():
+        major, sep, _ = mime_type.partition('/')
+        media_type = self._MIME_MAJOR_TYPES.get(major) if sep else None
+        if media_type:
+            return media_type
+        if 'gif' in mime_type.lower():
             return 'animation'
-        else:
-            return 'document'
+        return 'document'
     
     def _get_document_filename(self, document, message_id: int, media_type: str) -> str:
         """获取文档文件名"""
@@ -142,14 +227,7 @@ class MediaDownloader:
                 return attr.file_name
         
         # 如果没有文件名，根据类型生成
-        extensions = {
-            'photo': 'jpg',
-            'video': 'mp4',
-            'audio': 'mp3',
-            'animation': 'gif',
-            'document': 'bin'
-        }
-        ext = extensions.get(media_type, 'bin')
+        ext = self._DEFAULT_EXTENSIONS.get(media_type, 'bin')
         return f"{media_type}_{message_id}.{ext}"
     
     def _estimate_photo_size(self, photo) -> int:
@@ -212,45 +290,68 @@ class MediaDownloader:
             filename = name[:250] + '.' + ext
         return filename
     
-    async def _download_file(self, message: Message, media_info: dict, file_path: Path, client: TelegramClient):
-        """下载文件 (使用 Telethon)"""
+    async def _download_file(self, message: Message, media_info: dict, file_path: Union[Path, type], client: TelegramClient):
+        """下载文件 (使用 Telethon)，file_path 为 bytes 时返回文件内容"""
         file_name = media_info.get('file_name', 'unknown')
         file_size_mb = media_info.get('file_size', 0) / (1024 * 1024)
         
         try:
-            logger.info(f"🔄 开始下载文件: {file_name} ({file_size_mb:.1f}MB)")
+            logger.info("🔄 开始下载文件: %s (%.1fMB)", file_name, file_size_mb)
             
             # 使用 Telethon 下载媒体
-            await client.download_media(message, file=str(file_path))
+            if file_path is bytes:
+                data = await client.download_media(message, file=bytes)
+                logger.info("✅ 文件下载完成: %s", file_name)
+                return data
+            
+            if isinstance(message.media, MessageMediaDocument) and message.media.document:
+                # 文档（大文件）流式下载，写盘在线程中进行，不阻塞事件循环
+                await self._stream_document_to_file(client, message.media.document, file_path)
+            else:
+                await client.download_media(message, file=str(file_path))
             
-            logger.info(f"✅ 文件下载完成: {file_path}")
+            logger.info("✅ 文件下载完成: %s", file_path)
             
         except RPCError as e:
             # 详细记录Telegram API错误
             error_code = getattr(e, 'code', 'Unknown')
             error_message = str(e)
             
-            logger.error(f"❌ Telegram API错误 - 文件: {file_name} ({file_size_mb:.1f}MB)")
-            logger.error(f"   错误代码: {error_code}")
-            logger.error(f"   错误信息: {error_message}")
+            logger.error("❌ Telegram API错误 - 文件: %s (%.1fMB)", file_name, file_size_mb)
+            logger.error("   错误代码: %s", error_code)
+            logger.error("   错误信息: %s", error_message)
             
             # User API 通常不会有20MB限制，但记录其他错误
-            if "file is too big" in error_message.lower():
-                logger.error(f"   🚫 文件过大错误（不应该出现在User API中）")
-            elif "flood" in error_message.lower():
-                logger.error(f"   🚫 请求频率限制，请稍后重试")
-            elif "not found" in error_message.lower():
-                logger.error(f"   🚫 文件未找到，可能已被删除")
+            error_text = error_message.casefold()
+            if "file is too big" in error_text:
+                logger.error("   🚫 文件过大错误（不应该出现在User API中）")
+            elif "flood" in error_text:
+                logger.error("   🚫 请求频率限制，请稍后重试")
+            elif "not found" in error_text:
+                logger.error("   🚫 文件未找到，可能已被删除")
             else:
-                logger.error(f"   🚫 其他API错误")
+                logger.error("   🚫 其他API错误")
             
             raise
             
         except Exception as e:
-            logger.error(f"❌ 下载文件时发生未知错误: {file_name} ({file_size_mb:.1f}MB)")
-            logger.error(f"   错误详情: {type(e).__name__}: {e}")
+            logger.error("❌ 下载文件时发生未知错误: %s (%.1fMB)", file_name, file_size_mb)
+            logger.error("   错误详情: %s: %s", type(e).__name__, e)
             raise
     
+    async def _stream_document_to_file(self, client: TelegramClient, document, file_path: Path):
+        """分块下载文档并批量异步写入文件"""
+        buffer = bytearray()
+        async with aiofiles.open(file_path, 'wb') as f:
+            async for chunk in client.iter_download(document):
+                buffer += chunk
+                if len(buffer) >= self._WRITE_BATCH_SIZE:
+                    await f.write(bytes(buffer))
+                    buffer.clear()
+            
+            if buffer:
+                await f.write(bytes(buffer))
+    
     def cleanup_old_files(self, max_age_hours: int = 24):
         """清理旧文件"""
         try:
@@ -258,15 +359,16 @@ class MediaDownloader:
             current_time = time.time()
             max_age_seconds = max_age_hours * 3600
             
-            for file_path in self.download_path.iterdir():
-                if file_path.is_file():
-                    file_age = current_time - file_path.stat().st_mtime
-                    if file_age > max_age_seconds:
-                        file_path.unlink()
-                        logger.info(f"删除旧文件: {file_path}")
+            with os.scandir(self.download_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        file_age = current_time - entry.stat().st_mtime
+                        if file_age > max_age_seconds:
+                            os.remove(entry.path)
+                            logger.info("删除旧文件: %s", entry.path)
             
         except Exception as e:
-            logger.error(f"清理旧文件时出错: {e}")
+            logger.error("清理旧文件时出错: %s", e)
     
     def get_download_stats(self) -> dict:
         """获取下载统计信息"""
@@ -274,10 +376,12 @@ class MediaDownloader:
             total_files = 0
             total_size = 0
             
-            for file_path in self.download_path.iterdir():
-                if file_path.is_file():
-                    total_files += 1
-                    total_size += file_path.stat().st_size
+            # os.scandir 直接返回目录项，无需为每个文件构造 Path 对象
+            with os.scandir(self.download_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        total_files += 1
+                        total_size += entry.stat().st_size
             
             return {
                 'total_files': total_files,
@@ -287,5 +391,5 @@ class MediaDownloader:
             }
             
         except Exception as e:
-            logger.error(f"获取下载统计时出错: {e}")
+            logger.error("获取下载统计时出错: %s", e)
             return {'total_files': 0, 'total_size': 0, 'total_size_mb': 0, 'total_size_gb': 0}
\ No newline at end of file
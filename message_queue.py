@@ -6,21 +6,42 @@ import asyncio
 import json
 import logging
 import random
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from dataclasses import dataclass, asdict
 from telethon.tl.types import Message
 
+# orjson 序列化更快 (可选依赖)，未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
 
+def _dump_json(data: Any) -> bytes:
+    """序列化队列数据为 UTF-8 JSON"""
+    if orjson is not None:
+        return orjson.dumps(data, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE)
+    return json.dumps(data, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+
+
+def _load_json(raw: bytes) -> Any:
+    """反序列化队列数据"""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
 @dataclass
 class QueuedMessage:
     """队列中的消息"""
     message_id: int
     channel_title: str
-    files: List[Dict[str, Any]]  # [{'path': str, 'type': str}]
+    files: List[Dict[str, Any]]  # [{'path': Path, 'type': str, ...}]
     text_content: str
     send_time: float
     added_time: float
@@ -34,8 +55,9 @@ class QueuedMessage:
     
     @classmethod
     def from_dict(cls, data: dict) -> 'QueuedMessage':
-        """从字典创建对象"""
-        return cls(**data)
+        """从字典创建对象，保存时转为字符串的文件路径恢复为 Path"""
+        files = [{**file_info, 'path': Path(file_info['path'])} for file_info in data.get('files', [])]
+        return cls(**{**data, 'files': files})
 
 
 class MessageQueue:
@@ -47,6 +69,9 @@ class MessageQueue:
         self.processing = False
         self.queue_task: Optional[asyncio.Task] = None
         
+        # 队列文件读写线程池（单线程，保证写入顺序）
+        self._io_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='queue-io')
+        
         # 统计信息
         self.total_queued = 0
         self.total_sent = 0
@@ -74,7 +99,8 @@ class MessageQueue:
                 # 随机发送模式
                 send_delay = random.uniform(self.config.min_send_delay, self.config.max_send_delay)
             
-            send_time = asyncio.get_event_loop().time() + send_delay
+            now = asyncio.get_running_loop().time()
+            send_time = now + send_delay
             
             # 创建队列消息
             queued_msg = QueuedMessage(
@@ -83,7 +109,7 @@ class MessageQueue:
                 files=files,
                 text_content=message.text or message.caption or "",
                 send_time=send_time,
-                added_time=asyncio.get_event_loop().time(),
+                added_time=now,
                 priority=0
             )
             
@@ -98,7 +124,7 @@ class MessageQueue:
             
             # 自动保存队列
             if self.config.auto_save_queue:
-                self._save_queue()
+                await self._save_queue_async()
             
             return True
             
@@ -135,7 +161,7 @@ class MessageQueue:
         """处理队列中的消息"""
         while self.processing:
             try:
-                current_time = asyncio.get_event_loop().time()
+                current_time = asyncio.get_running_loop().time()
                 messages_to_send = []
                 remaining_messages = []
                 
@@ -170,7 +196,7 @@ class MessageQueue:
                 
                 # 自动保存队列状态
                 if self.config.auto_save_queue and messages_to_send:
-                    self._save_queue()
+                    await self._save_queue_async()
                 
                 # 等待下次检查
                 await asyncio.sleep(self.config.queue_check_interval)
@@ -209,19 +235,24 @@ class MessageQueue:
             return False
     
     async def _cleanup_files(self, files: List[Dict[str, Any]]):
-        """清理已发送的文件"""
-        for file_info in files:
+        """清理已发送的文件（在线程中删除，不阻塞事件循环）"""
+        paths = [file_info['path'] for file_info in files if file_info['path'] is not None]
+        if paths:
+            await asyncio.to_thread(self._remove_files, paths)
+    
+    @staticmethod
+    def _remove_files(paths: List[Path]):
+        """同步删除文件，文件不存在时忽略"""
+        for file_path in paths:
             try:
-                file_path = Path(file_info['path'])
-                if file_path.exists():
-                    file_path.unlink()
-                    logger.debug(f"🧹 已清理文件: {file_path}")
+                file_path.unlink(missing_ok=True)
+                logger.debug(f"🧹 已清理文件: {file_path}")
             except Exception as e:
-                logger.warning(f"⚠️ 清理文件失败 {file_info['path']}: {e}")
+                logger.warning(f"⚠️ 清理文件失败 {file_path}: {e}")
     
     def get_status(self) -> dict:
         """获取队列状态"""
-        current_time = asyncio.get_event_loop().time()
+        current_time = asyncio.get_running_loop().time()
         
         # 计算统计信息
         pending_count = len(self.queue)
@@ -257,25 +288,42 @@ class MessageQueue:
     
     def _save_queue(self):
         """保存队列到文件"""
+        self._write_queue_file(self._build_queue_snapshot())
+    
+    async def _save_queue_async(self):
+        """在线程池中保存队列到文件，避免阻塞事件循环"""
+        # 快照在事件循环线程中生成，避免与队列修改并发
+        queue_data = self._build_queue_snapshot()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._io_pool, self._write_queue_file, queue_data)
+    
+    def _build_queue_snapshot(self) -> dict:
+        """生成队列数据快照"""
+        return {
+            'queue': [msg.to_dict() for msg in self.queue],
+            'stats': {
+                'total_queued': self.total_queued,
+                'total_sent': self.total_sent,
+                'total_failed': self.total_failed
+            },
+            'saved_at': datetime.now().isoformat()
+        }
+    
+    def _write_queue_file(self, queue_data: dict):
+        """将队列数据写入文件"""
         try:
-            queue_data = {
-                'queue': [msg.to_dict() for msg in self.queue],
-                'stats': {
-                    'total_queued': self.total_queued,
-                    'total_sent': self.total_sent,
-                    'total_failed': self.total_failed
-                },
-                'saved_at': datetime.now().isoformat()
-            }
-            
-            with open(self.config.queue_save_path, 'w', encoding='utf-8') as f:
-                json.dump(queue_data, f, ensure_ascii=False, indent=2)
+            with open(self.config.queue_save_path, 'wb') as f:
+                f.write(_dump_json(queue_data))
             
             logger.debug(f"💾 队列已保存到 {self.config.queue_save_path}")
             
         except Exception as e:
             logger.error(f"❌ 保存队列失败: {e}")
     
+    def close(self):
+        """关闭队列文件读写线程池"""
+        self._io_pool.shutdown(wait=True)
+    
     def _load_queue(self):
         """从文件加载队列"""
         try:
@@ -283,8 +331,8 @@ class MessageQueue:
             if not queue_file.exists():
                 return
             
-            with open(queue_file, 'r', encoding='utf-8') as f:
-                queue_data = json.load(f)
+            with open(queue_file, 'rb') as f:
+                queue_data = _load_json(f.read())
             
             # 恢复队列
             for msg_data in queue_data.get('queue', []):
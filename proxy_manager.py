@@ -4,8 +4,6 @@
 
 import asyncio
 import logging
-import random
-import socket
 import time
 from pathlib import Path
 from typing import List, Dict, Optional, Any
@@ -197,7 +195,11 @@ class ProxyManager:
         self.current_proxy_index = old_index
     
     async def _test_proxy(self, proxy_config: Dict) -> bool:
-        """测试单个代理"""
+        """测试单个代理（阻塞的连接测试在线程中执行，不阻塞事件循环）"""
+        return await asyncio.to_thread(self._probe_proxy, proxy_config)
+    
+    def _probe_proxy(self, proxy_config: Dict) -> bool:
+        """通过代理连接 Telegram 服务器，返回是否成功"""
         try:
             import socks
             
@@ -287,17 +289,17 @@ class ProxyManager:
         """测试所有代理的连通性"""
         results = {}
         
-        logger.info("🔍 测试所有代理连通性...")
+        logger.info(f"🔍 并发测试 {len(self.proxy_list)} 个代理的连通性...")
+        
+        # 所有代理同时测试，总耗时约为最慢的一个代理
+        test_results = await asyncio.gather(*(self._test_proxy(proxy) for proxy in self.proxy_list))
         
-        for i, proxy in enumerate(self.proxy_list):
+        for i, (proxy, result) in enumerate(zip(self.proxy_list, test_results)):
             proxy_name = proxy.get('name', f"proxy_{i}")
-            logger.info(f"测试代理 {i+1}/{len(self.proxy_list)}: {proxy_name}")
-            
-            result = await self._test_proxy(proxy)
             results[proxy_name] = result
             
             status = "✅ 成功" if result else "❌ 失败"
-            logger.info(f"  {status}")
+            logger.info(f"测试代理 {i+1}/{len(self.proxy_list)}: {proxy_name} {status}")
         
         # 统计结果
         success_count = sum(1 for r in results.values() if r)
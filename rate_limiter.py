@@ -0,0 +1,83 @@
+"""
+速率限制器 - 控制发送频率，避免触发 Telegram FloodWait
+"""
+
+import asyncio
+import logging
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """滑动窗口速率限制器 - 同时限制全局和单个会话的请求频率"""
+    
+    def __init__(self, global_rate: int, per_key_rate: int, period: float = 1.0):
+        self.global_rate = global_rate      # 每个周期内全局最大请求数
+        self.per_key_rate = per_key_rate    # 每个周期内单个会话最大请求数
+        self.period = period                # 窗口长度（秒）
+        
+        self._global_calls: Deque[float] = deque()
+        self._key_calls: Dict[Any, Deque[float]] = defaultdict(deque)
+        self._lock = asyncio.Lock()
+        self._suspended_until = 0.0         # 在此时间之前暂停所有请求（monotonic）
+        self._oldest_key_call = 0.0         # 会话记录中最早的请求时间，用于判断何时清理空会话
+    
+    @asynccontextmanager
+    async def acquire(self, key: Optional[Any] = None):
+        """等待可用的发送额度，key 为会话标识（如频道ID）"""
+        await self._wait_for_slot(key)
+        yield
+    
+    def suspend(self, seconds: float):
+        """暂停所有请求 seconds 秒（如收到 FloodWait），已有更长的暂停时保持不变"""
+        self._suspended_until = max(self._suspended_until, time.monotonic() + seconds)
+    
+    async def _wait_for_slot(self, key: Optional[Any]):
+        """按先来先到的顺序等待，直到暂停结束且全局和会话窗口都有空位"""
+        async with self._lock:
+            key_calls = self._key_calls[key] if key is not None else None
+            
+            while True:
+                now = time.monotonic()
+                self._evict(self._global_calls, now)
+                wait = max(0.0, self._suspended_until - now)
+                
+                if len(self._global_calls) >= self.global_rate:
+                    wait = max(wait, self._global_calls[0] + self.period - now)
+                
+                if key_calls is not None:
+                    self._evict(key_calls, now)
+                    if len(key_calls) >= self.per_key_rate:
+                        wait = max(wait, key_calls[0] + self.period - now)
+                
+                if wait <= 0:
+                    break
+                
+                logger.debug("⏳ 速率限制，等待 %.2f 秒", wait)
+                await asyncio.sleep(wait)
+            
+            self._global_calls.append(now)
+            if key_calls is not None:
+                key_calls.append(now)
+            self._prune_keys(now)
+    
+    def _evict(self, calls: Deque[float], now: float):
+        """移除窗口之外的请求记录"""
+        while calls and now - calls[0] >= self.period:
+            calls.popleft()
+    
+    def _prune_keys(self, now: float):
+        """删除窗口内已没有请求记录的会话，避免会话标识越来越多"""
+        # 最早的记录都已过期时才需要遍历，大多数调用直接返回
+        if now - self._oldest_key_call < self.period:
+            return
+        for key in list(self._key_calls):
+            calls = self._key_calls[key]
+            self._evict(calls, now)
+            if not calls:
+                del self._key_calls[key]
+        self._oldest_key_call = min((calls[0] for calls in self._key_calls.values()), default=now)
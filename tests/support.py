@@ -0,0 +1,28 @@
+"""
+测试公共设置 - 提供创建 Config 所需的最小环境变量
+"""
+
+import logging
+import os
+import tempfile
+
+_TEST_DIR = tempfile.mkdtemp(prefix='download_bot_test_')
+
+for _key, _value in {
+    'API_ID': '1',
+    'API_HASH': '0' * 32,
+    'PHONE_NUMBER': '+10000000000',
+    'SOURCE_CHANNEL_ID': '@source',
+    'TARGET_CHANNEL_ID': '-1000000000000',
+    'DOWNLOAD_PATH': os.path.join(_TEST_DIR, 'downloads'),
+    'SESSION_PATH': _TEST_DIR,
+    'QUEUE_SAVE_PATH': os.path.join(_TEST_DIR, 'queue_data.json'),
+    'AUTO_SAVE_QUEUE': 'false',
+    'RANDOM_DELAY_MIN': '0',
+    'RANDOM_DELAY_MAX': '0',
+    'SEND_RATE_PER_CHAT': '100',
+}.items():
+    os.environ.setdefault(_key, _value)
+
+# 测试中不输出日志，也不创建 bot.log
+logging.disable(logging.CRITICAL)
@@ -0,0 +1,130 @@
+"""
+消息发送测试
+"""
+
+import asyncio
+import os
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import support  # noqa: F401
+from bot_handler import TelegramBotHandler
+from config import Config
+
+
+class FakeClient:
+    """记录 send_file 调用，代替真实客户端"""
+    
+    def __init__(self):
+        self.calls = []
+    
+    async def send_file(self, entity, file, caption, parse_mode=None, **kwargs):
+        self.calls.append((file, caption))
+        return [None] * len(file) if isinstance(file, list) else None
+
+
+def make_photo(i: int) -> dict:
+    return {'path': None, 'data': b'x', 'file_name': f'{i}.jpg', 'type': 'photo', 'size': 1}
+
+
+class AlbumBatchTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        env = {'ALBUM_BATCH_ENABLED': 'true', 'ALBUM_BATCH_WINDOW': '60', 'SEND_RATE_PER_CHAT': '100'}
+        with mock.patch.dict(os.environ, env):
+            self.handler = TelegramBotHandler(Config())
+        self.client = FakeClient()
+    
+    async def _forward(self, i: int):
+        await self.handler.forward_message(SimpleNamespace(text=f'caption {i}'), [make_photo(i)], self.client)
+    
+    async def test_full_album_is_sent_without_waiting_for_window(self):
+        sends = [asyncio.create_task(self._forward(i)) for i in range(TelegramBotHandler.ALBUM_MAX_SIZE + 2)]
+        await asyncio.wait_for(asyncio.gather(*sends[:TelegramBotHandler.ALBUM_MAX_SIZE]), timeout=1)
+        
+        self.assertEqual(len(self.client.calls), 1)
+        files, captions = self.client.calls[0]
+        self.assertEqual(len(files), TelegramBotHandler.ALBUM_MAX_SIZE)
+        self.assertEqual(captions, [f'caption {i}' for i in range(TelegramBotHandler.ALBUM_MAX_SIZE)])
+        # 剩余的媒体等待下一个合并窗口
+        self.assertEqual(len(self.handler._pending_album), 2)
+        self.assertFalse(any(send.done() for send in sends[TelegramBotHandler.ALBUM_MAX_SIZE:]))
+        
+        await self.handler.flush_albums(self.client)
+        await asyncio.gather(*sends)
+        self.assertEqual(len(self.client.calls), 2)
+    
+    async def test_flush_albums_sends_pending_and_waits(self):
+        sends = [asyncio.create_task(self._forward(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        self.assertEqual(self.client.calls, [])
+        
+        await asyncio.wait_for(self.handler.flush_albums(self.client), timeout=1)
+        self.assertEqual(len(self.client.calls), 1)
+        self.assertEqual(len(self.client.calls[0][0]), 3)
+        self.assertFalse(self.handler._album_flush_tasks)
+        await asyncio.gather(*sends)
+        
+        # 退出后加入的媒体不再等待合并窗口
+        await asyncio.wait_for(self._forward(3), timeout=1)
+        self.assertEqual(len(self.client.calls), 2)
+    
+    async def test_failed_album_fails_every_sender(self):
+        error = RuntimeError("boom")
+        with mock.patch.object(TelegramBotHandler, '_send_media_group', mock.AsyncMock(side_effect=error)):
+            sends = [asyncio.create_task(self._forward(i)) for i in range(2)]
+            await asyncio.sleep(0)
+            await self.handler.flush_albums(self.client)
+            results = await asyncio.gather(*sends, return_exceptions=True)
+        
+        self.assertEqual(results, [error, error])
+    
+    
+    async def test_fallback_failure_only_fails_unsent_messages(self):
+        client = mock.Mock()
+        
+        async def send_file(entity, file, caption, parse_mode=None, **kwargs):
+            # 整个相册和第二个文件发送失败，其余文件逐个发送成功
+            if isinstance(file, list) or file.getvalue() == b'1':
+                raise RuntimeError("rejected")
+        
+        client.send_file = send_file
+        photos = [make_photo(i) for i in range(3)]
+        for i, photo in enumerate(photos):
+            photo['data'] = b'%d' % i
+        sends = [
+            asyncio.create_task(self.handler.forward_message(SimpleNamespace(text=''), [photo], client))
+            for photo in photos
+        ]
+        await asyncio.sleep(0)
+        await self.handler.flush_albums(client)
+        results = await asyncio.gather(*sends, return_exceptions=True)
+        
+        self.assertIsNone(results[0])
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertIsNone(results[2])
+    
+    
+    async def test_cancelled_flush_fails_waiting_senders(self):
+        started = asyncio.Event()
+        
+        async def hang(*args, **kwargs):
+            started.set()
+            await asyncio.sleep(60)
+        
+        with mock.patch.object(TelegramBotHandler, '_send_media_group', hang):
+            sends = [asyncio.create_task(self._forward(i)) for i in range(2)]
+            await asyncio.sleep(0)
+            flush = asyncio.create_task(self.handler.flush_albums(self.client))
+            await started.wait()
+            for task in self.handler._album_flush_tasks:
+                task.cancel()
+            await asyncio.gather(flush, return_exceptions=True)
+            results = await asyncio.wait_for(asyncio.gather(*sends, return_exceptions=True), timeout=1)
+        
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
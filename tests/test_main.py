@@ -0,0 +1,347 @@
+"""
+用户客户端测试
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+import support  # noqa: F401
+import main
+from telethon.errors import FloodWaitError
+
+
+class ShutdownTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = main.TelegramUserClient()
+    
+    async def test_second_signal_cancels_inflight(self):
+        task = self.client._track_task(asyncio.create_task(asyncio.sleep(60)))
+        
+        self.client.request_shutdown(15)
+        await asyncio.sleep(0)
+        self.assertTrue(self.client._shutdown_event.is_set())
+        self.assertFalse(task.done())
+        
+        self.client.request_shutdown(15)
+        await asyncio.gather(task, return_exceptions=True)
+        self.assertTrue(task.cancelled())
+    
+    async def test_stop_forward_workers_returns_after_force_cancel(self):
+        self.client._start_forward_workers()
+        # 已排队但转发协程被取消的消息不会再被处理
+        self.client._forward_queue.put_nowait((None, [], "消息"))
+        self.client._shutdown_event.set()
+        self.client.request_shutdown(15)
+        
+        await asyncio.wait_for(self.client._stop_forward_workers(), timeout=1)
+        self.assertEqual(self.client._forward_workers, [])
+
+
+
+class CommandAccessTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = main.TelegramUserClient()
+        self.client.me = SimpleNamespace(id=1)
+        self.client.config.admin_user_ids = frozenset({2})
+        patcher = mock.patch.object(self.client, '_handle_command_message', mock.AsyncMock())
+        self.handle_command = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    async def _receive(self, sender_id: int, chat_id: int, out: bool = False):
+        text = '/queue clear'
+        event = SimpleNamespace(
+            chat_id=chat_id, sender_id=sender_id, is_private=True, out=out,
+            raw_text=text, message=SimpleNamespace(text=text)
+        )
+        await self.client._on_new_message(event)
+    
+    async def test_command_from_stranger_is_ignored(self):
+        await self._receive(sender_id=3, chat_id=3)
+        self.handle_command.assert_not_awaited()
+    
+    async def test_command_from_admin_is_handled(self):
+        await self._receive(sender_id=2, chat_id=2)
+        self.handle_command.assert_awaited_once()
+    
+    async def test_command_in_saved_messages_is_handled(self):
+        await self._receive(sender_id=1, chat_id=1, out=True)
+        self.handle_command.assert_awaited_once()
+    
+    async def test_own_message_to_another_chat_is_ignored(self):
+        await self._receive(sender_id=1, chat_id=3, out=True)
+        self.handle_command.assert_not_awaited()
+
+
+class DownloadCommandTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = main.TelegramUserClient()
+        self.status_message = SimpleNamespace(edit=mock.AsyncMock())
+        self.event = SimpleNamespace(respond=mock.AsyncMock(return_value=self.status_message))
+    
+    async def test_non_decimal_digits_are_rejected(self):
+        with mock.patch.object(self.client, 'command_download_by_channel_date', mock.AsyncMock()) as command:
+            await self.client._handle_telegram_download_command(self.event, ['@source', '\u00b2'])
+            await self.client._handle_telegram_download_command(self.event, ['@source', '1', '\u00b3'])
+        
+        command.assert_not_awaited()
+        self.assertEqual(self.event.respond.await_count, 2)
+        self.assertIn("参数错误", self.event.respond.await_args.args[0])
+    
+    
+    async def test_progress_throttles_but_always_shows_completion(self):
+        async def command(channel_id, days_ago, limit, progress=None):
+            for done in range(1, 4):
+                await progress(done, 3)
+            return 3
+        
+        with mock.patch.object(self.client, 'command_download_by_channel_date', command):
+            await self.client._handle_telegram_download_command(self.event, ['@source', '0', '3'])
+        
+        edits = [call.args[0] for call in self.status_message.edit.await_args_list]
+        # 中间进度在节流间隔内被跳过，3/3 和最终结果总会显示
+        self.assertEqual(len(edits), 2)
+        self.assertIn("3/3", edits[0])
+        self.assertIn("下载完成", edits[1])
+
+
+class ScriptedSendClient:
+    """send_file 按调用次序触发指定的异常，记录每次调用的文件数和成功发出的文件内容"""
+    
+    def __init__(self, failures: dict):
+        self.failures = failures
+        self.calls = []
+        self.posted = []
+    
+    async def send_file(self, entity, file, caption, parse_mode=None, **kwargs):
+        files = file if isinstance(file, list) else [file]
+        self.calls.append(len(files))
+        error = self.failures.get(len(self.calls))
+        if error is not None:
+            raise error
+        self.posted.extend(f.getvalue() for f in files)
+        return [None] * len(files) if isinstance(file, list) else None
+
+
+def make_memory_files(count: int) -> list:
+    return [
+        {'path': None, 'data': b'%d' % i, 'file_name': f'{i}.jpg', 'type': 'photo', 'size': 1}
+        for i in range(count)
+    ]
+
+
+class ForwardFloodWaitTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = main.TelegramUserClient()
+        self.message = SimpleNamespace(id=7, text='caption')
+    
+    async def _forward(self, files: list, failures: dict):
+        self.client.client = ScriptedSendClient(failures)
+        with mock.patch.object(self.client._forward_limiter, 'suspend') as suspend:
+            ok = await self.client._forward_downloaded(self.message, files)
+        self.assertTrue(ok)
+        return suspend
+    
+    async def test_media_group_flood_wait_suspends_all_forwards(self):
+        suspend = await self._forward(make_memory_files(2), {1: FloodWaitError(request=None, capture=42)})
+        
+        suspend.assert_called_once_with(42)
+        # FloodWait 不回退为逐个发送，暂停后整组重试一次
+        self.assertEqual(self.client.client.calls, [2, 2])
+    
+    async def test_retry_resumes_after_sent_albums(self):
+        files = make_memory_files(12)
+        expected = sorted(file_info['data'] for file_info in files)
+        await self._forward(files, {2: FloodWaitError(request=None, capture=5)})
+        
+        # 第一个相册已发出，重试只发送触发 FloodWait 的第二个相册
+        self.assertEqual(self.client.client.calls, [10, 2, 2])
+        self.assertEqual(sorted(self.client.client.posted), expected)
+    
+    async def test_retry_resumes_after_sent_fallback_files(self):
+        files = make_memory_files(3)
+        expected = sorted(file_info['data'] for file_info in files)
+        # 相册发送失败后逐个发送，其中一个文件触发 FloodWait
+        await self._forward(files, {1: RuntimeError("album rejected"), 3: FloodWaitError(request=None, capture=5)})
+        
+        self.assertEqual(self.client.client.calls, [3, 1, 1, 1, 1])
+        self.assertEqual(sorted(self.client.client.posted), expected)
+
+
+class CleanupWorkerTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = main.TelegramUserClient()
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+    
+    def _make_file(self, name: str) -> dict:
+        path = Path(self.temp_dir.name) / name
+        path.write_bytes(b'x')
+        return {'path': path, 'type': 'photo', 'size': 1}
+    
+    async def test_queued_files_are_removed_in_one_batch(self):
+        batches = [[self._make_file('a.jpg'), self._make_file('b.jpg')], [self._make_file('c.jpg')]]
+        in_memory = {'path': None, 'data': b'x', 'type': 'photo', 'size': 1}
+        
+        with mock.patch.object(main.TelegramUserClient, '_remove_files', wraps=main.TelegramUserClient._remove_files) as remove:
+            for file_infos in batches:
+                self.client._schedule_cleanup(file_infos)
+            self.client._schedule_cleanup([in_memory])
+            await self.client._stop_cleanup_worker()
+        
+        # 清理协程启动前积压的文件合并为一次线程调用，内存中的文件不进入清理队列
+        remove.assert_called_once_with([file_info['path'] for file_infos in batches for file_info in file_infos])
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+        self.assertNotIn('data', in_memory)
+        self.assertIsNone(self.client._cleanup_worker)
+    
+    async def test_worker_is_started_once(self):
+        self.client._schedule_cleanup([self._make_file('a.jpg')])
+        worker = self.client._cleanup_worker
+        self.client._schedule_cleanup([self._make_file('b.jpg')])
+        self.assertIs(self.client._cleanup_worker, worker)
+        
+        await self.client._stop_cleanup_worker()
+        self.assertTrue(worker.cancelled())
+    
+    
+    async def test_timed_out_media_group_releases_finished_files(self):
+        self.client._loop = asyncio.get_running_loop()
+        downloader = self.client.media_downloader
+        disk_file = self._make_file('a.mp4')
+        
+        async def download_media(message, client, **kwargs):
+            if message.id == 2:
+                await asyncio.sleep(60)
+            # 第一条消息下载完成：一个内存文件和一个本地文件
+            self.assertTrue(downloader._reserve_memory(10))
+            return [{'path': None, 'data': b'x' * 10, 'type': 'photo', 'size': 10}, disk_file]
+        
+        group = main.MediaGroupState()
+        group.messages = group.media_messages = [SimpleNamespace(id=1, text=''), SimpleNamespace(id=2, text='')]
+        with mock.patch.object(downloader, 'download_media', download_media):
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.client._start_media_group_download(1, group), timeout=0.1)
+        await self.client._stop_cleanup_worker()
+        
+        self.assertEqual(downloader._memory_in_use, 0)
+        self.assertEqual(os.listdir(self.temp_dir.name), [])
+
+
+class FakeHistoryClient:
+    """iter_messages 返回固定的消息列表并记录参数"""
+    
+    def __init__(self, messages: list):
+        self.messages = messages
+        self.kwargs = None
+    
+    async def iter_messages(self, entity, **kwargs):
+        self.kwargs = kwargs
+        for message in self.messages[:kwargs.get('limit')]:
+            yield message
+
+
+def make_text_message(i: int, text: str = None) -> SimpleNamespace:
+    return SimpleNamespace(id=i, media=None, text=f'message {i}' if text is None else text)
+
+
+class BatchCommandTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.client = main.TelegramUserClient()
+        self.processed = []
+        
+        async def process_batch(messages, label, progress=None):
+            batch = [message async for message in messages]
+            self.processed.append(batch)
+            return len(batch)
+        
+        async def get_channel_entity(channel_id):
+            return SimpleNamespace(title='source')
+        
+        for patcher in (mock.patch.object(self.client, '_process_batch', process_batch),
+                        mock.patch.object(self.client, '_get_channel_entity', get_channel_entity),
+                        mock.patch.object(self.client, 'smart_delay', mock.AsyncMock())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    async def test_date_window_is_local_midnight_to_midnight(self):
+        windows = []
+        
+        async def iter_content_messages(entity, limit, offset_date=None, min_date=None):
+            windows.append((offset_date, min_date))
+            yield make_text_message(1)
+        
+        with mock.patch.object(self.client, '_iter_content_messages', iter_content_messages):
+            await self.client.command_download_by_channel_date('@source', days_ago=2, limit=10)
+        
+        end_date, start_date = windows[0]
+        # 带时区的本地 0 点，与 Telethon 返回的 UTC 消息时间可以直接比较
+        self.assertIsNotNone(start_date.tzinfo)
+        local_start = start_date.astimezone()
+        self.assertEqual(local_start.date(), (datetime.now() - timedelta(days=2)).date())
+        self.assertEqual((local_start.hour, local_start.minute, local_start.second, local_start.microsecond), (0, 0, 0, 0))
+        self.assertEqual(end_date - start_date, timedelta(days=1))
+        self.assertEqual(len(self.processed[0]), 1)
+    
+    async def test_latest_messages_have_no_date_window(self):
+        windows = []
+        
+        async def iter_content_messages(entity, limit, offset_date=None, min_date=None):
+            windows.append((offset_date, min_date))
+            return
+            yield
+        
+        with mock.patch.object(self.client, '_iter_content_messages', iter_content_messages):
+            await self.client.command_download_by_channel_date('@source', days_ago=0, limit=10)
+        
+        self.assertEqual(windows, [(None, None)])
+        self.client.smart_delay.assert_not_awaited()
+    
+    async def test_reservoir_sample_skips_empty_messages(self):
+        # 偶数 ID 的消息没有内容，不能被抽中
+        messages = [make_text_message(i, text=None if i % 2 else '') for i in range(main.TelegramUserClient.RANDOM_SAMPLE_POOL)]
+        self.client.client = FakeHistoryClient(messages)
+        
+        await self.client.manual_download_command(count=5)
+        
+        sample = self.processed[0]
+        self.assertEqual(len(sample), 5)
+        self.assertEqual(len({message.id for message in sample}), 5)
+        self.assertTrue(all(message.id % 2 for message in sample))
+        self.assertEqual(self.client.client.kwargs['limit'], main.TelegramUserClient.RANDOM_SAMPLE_POOL)
+    
+    async def test_reservoir_sample_returns_all_when_fewer_than_count(self):
+        self.client.client = FakeHistoryClient([make_text_message(i) for i in range(3)])
+        
+        await self.client.manual_download_command(count=5)
+        self.assertEqual([message.id for message in self.processed[0]], [0, 1, 2])
+    
+    async def test_reservoir_sample_is_uniform(self):
+        self.client.client = FakeHistoryClient([make_text_message(i) for i in range(10)])
+        trials = 2000
+        
+        with mock.patch.object(main.random, 'randrange', random.Random(1).randrange):
+            for _ in range(trials):
+                await self.client.manual_download_command(count=3)
+        
+        # 每条消息被抽中的概率都是 3/10
+        picks = Counter(message.id for sample in self.processed for message in sample)
+        for message_id in range(10):
+            self.assertAlmostEqual(picks[message_id] / trials, 0.3, delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+媒体下载测试
+"""
+
+import unittest
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import mock
+
+import support  # noqa: F401
+from config import Config
+from media_downloader import MediaDownloader
+from telethon.tl import types
+
+
+def make_document_message(message_id: int = 5, size: int = 1024):
+    """构造带一个视频文档的消息"""
+    document = types.Document(
+        id=1, access_hash=2, file_reference=b'', date=datetime.now(),
+        mime_type='video/mp4', size=size, dc_id=1,
+        attributes=[types.DocumentAttributeFilename('clip.mp4')]
+    )
+    return SimpleNamespace(id=message_id, chat_id=-100, media=types.MessageMediaDocument(document=document))
+
+
+class UploadedMediaCacheTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.downloader = MediaDownloader(Config())
+        self.message = make_document_message()
+    
+    async def test_cache_hit_skips_download(self):
+        cached = object()
+        lookup = mock.Mock(return_value=cached)
+        with mock.patch.object(self.downloader, '_download_file') as download_file:
+            files = await self.downloader.download_media(self.message, None, in_memory=True, uploaded_media=lookup)
+        
+        download_file.assert_not_called()
+        lookup.assert_called_once_with('-100:5:0')
+        self.assertEqual(len(files), 1)
+        self.assertIs(files[0]['media'], cached)
+        self.assertIsNone(files[0]['path'])
+        self.assertEqual(files[0]['type'], 'video')
+    
+    async def test_cache_miss_downloads(self):
+        lookup = mock.Mock(return_value=None)
+        download_file = mock.AsyncMock(return_value=b'x' * 1024)
+        with mock.patch.object(self.downloader, '_download_file', download_file):
+            files = await self.downloader.download_media(self.message, None, in_memory=True, uploaded_media=lookup)
+        
+        download_file.assert_awaited_once()
+        self.assertEqual(files[0]['data'], b'x' * 1024)
+        self.assertNotIn('media', files[0])
+
+
+
+class MemoryBudgetTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        config = Config()
+        config.in_memory_total_limit = 1024
+        self.downloader = MediaDownloader(config)
+        self.addCleanup(self._remove_downloads)
+        self.written = []
+    
+    def _remove_downloads(self):
+        for path in self.written:
+            path.unlink(missing_ok=True)
+    
+    async def _fake_download(self, message, media_info, file_path, client):
+        if file_path is bytes:
+            return b'x' * media_info['file_size']
+        file_path.write_bytes(b'x' * media_info['file_size'])
+        self.written.append(file_path)
+    
+    async def test_budget_exhausted_falls_back_to_disk(self):
+        with mock.patch.object(self.downloader, '_download_file', self._fake_download):
+            first = await self.downloader.download_media(make_document_message(1), None, in_memory=True)
+            second = await self.downloader.download_media(make_document_message(2), None, in_memory=True)
+            
+            self.assertIsNone(first[0]['path'])
+            self.assertEqual(len(first[0]['data']), 1024)
+            # 额度已被第一个文件占满，第二个文件落盘
+            self.assertIsNotNone(second[0]['path'])
+            self.assertNotIn('data', second[0])
+            
+            # 释放后额度恢复，新文件重新下载到内存
+            self.downloader.release_memory(first)
+            self.assertNotIn('data', first[0])
+            third = await self.downloader.download_media(make_document_message(3), None, in_memory=True)
+            self.assertIsNone(third[0]['path'])
+    
+    async def test_failed_download_returns_budget(self):
+        with mock.patch.object(self.downloader, '_download_file', mock.AsyncMock(return_value=None)):
+            files = await self.downloader.download_media(make_document_message(), None, in_memory=True)
+        
+        self.assertEqual(files, [])
+        self.assertTrue(self.downloader._reserve_memory(1024))
+
+
+if __name__ == '__main__':
+    unittest.main()
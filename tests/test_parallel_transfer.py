@@ -0,0 +1,93 @@
+"""
+并行分片上传测试
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import parallel_transfer
+from parallel_transfer import BIG_FILE_THRESHOLD, PART_SIZE, fast_upload
+from telethon.tl import types
+
+
+class FakeSender:
+    """记录收到的分片请求，代替真实的 MTProto 连接"""
+    
+    def __init__(self):
+        self.requests = []
+        self.disconnected = False
+    
+    async def send(self, request):
+        self.requests.append(request)
+        return True
+    
+    async def disconnect(self):
+        self.disconnected = True
+
+
+class FastUploadTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        # 10MB 阈值之上再加 3 个完整分片和一个 123 字节的尾分片
+        self.tail_size = 123
+        self.file_size = BIG_FILE_THRESHOLD + 3 * PART_SIZE + self.tail_size
+        self.content = os.urandom(self.file_size)
+        
+        fd, self.path = tempfile.mkstemp(suffix='.bin')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.content)
+        self.addCleanup(os.remove, self.path)
+        
+        self.senders = []
+        
+        async def create_sender(client):
+            sender = FakeSender()
+            self.senders.append(sender)
+            return sender
+        
+        patcher = mock.patch.object(parallel_transfer, '_create_sender', create_sender)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    async def test_parts_are_uploaded_once_over_separate_senders(self):
+        result = await fast_upload(object(), self.path, workers=4)
+        
+        expected_parts = BIG_FILE_THRESHOLD // PART_SIZE + 4
+        self.assertIsInstance(result, types.InputFileBig)
+        self.assertEqual(result.parts, expected_parts)
+        self.assertEqual(result.name, os.path.basename(self.path))
+        
+        # 每个 worker 使用自己的连接，结束后全部断开
+        self.assertEqual(len(self.senders), 4)
+        self.assertTrue(all(sender.disconnected for sender in self.senders))
+        self.assertTrue(all(sender.requests for sender in self.senders))
+        
+        requests = sorted(
+            (request for sender in self.senders for request in sender.requests),
+            key=lambda request: request.file_part
+        )
+        self.assertEqual([request.file_part for request in requests], list(range(expected_parts)))
+        self.assertTrue(all(request.file_id == result.id for request in requests))
+        self.assertTrue(all(request.file_total_parts == expected_parts for request in requests))
+        
+        # 除最后一个分片外都是完整分片，拼接后与原文件一致
+        self.assertTrue(all(len(request.bytes) == PART_SIZE for request in requests[:-1]))
+        self.assertEqual(len(requests[-1].bytes), self.tail_size)
+        self.assertEqual(b''.join(request.bytes for request in requests), self.content)
+    
+    async def test_workers_capped_by_part_count(self):
+        result = await fast_upload(object(), self.path, workers=1000)
+        self.assertEqual(len(self.senders), result.parts)
+    
+    async def test_small_file_rejected(self):
+        with open(self.path, 'r+b') as f:
+            f.truncate(BIG_FILE_THRESHOLD)
+        with self.assertRaises(ValueError):
+            await fast_upload(object(), self.path)
+        self.assertEqual(self.senders, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+速率限制器测试
+"""
+
+import unittest
+from unittest import mock
+
+import rate_limiter
+from rate_limiter import RateLimiter
+
+
+class FakeClock:
+    """可控的 monotonic 时钟，sleep 直接推进时间"""
+    
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+    
+    def monotonic(self) -> float:
+        return self.now
+    
+    async def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimiterTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        for patcher in (mock.patch.object(rate_limiter.time, 'monotonic', self.clock.monotonic),
+                        mock.patch.object(rate_limiter.asyncio, 'sleep', self.clock.sleep)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    async def _acquire(self, limiter: RateLimiter, key=None):
+        async with limiter.acquire(key):
+            pass
+    
+    async def test_global_window(self):
+        limiter = RateLimiter(2, 10, period=1.0)
+        for _ in range(3):
+            await self._acquire(limiter)
+        
+        # 第三次请求等待第一条记录滑出窗口
+        self.assertEqual(self.clock.sleeps, [1.0])
+    
+    async def test_per_key_window(self):
+        limiter = RateLimiter(10, 1, period=1.0)
+        await self._acquire(limiter, 'a')
+        await self._acquire(limiter, 'b')
+        self.assertEqual(self.clock.sleeps, [])
+        
+        await self._acquire(limiter, 'a')
+        self.assertEqual(self.clock.sleeps, [1.0])
+    
+    async def test_full_global_window_does_not_shorten_suspension(self):
+        limiter = RateLimiter(1, 10, period=1.0)
+        await self._acquire(limiter)
+        limiter.suspend(30)
+        
+        await self._acquire(limiter)
+        self.assertEqual(self.clock.sleeps, [30])
+    
+    async def test_idle_keys_are_removed(self):
+        limiter = RateLimiter(100, 10, period=1.0)
+        for key in range(5):
+            await self._acquire(limiter, key)
+        self.assertEqual(len(limiter._key_calls), 5)
+        
+        self.clock.now += 2
+        await self._acquire(limiter, 'next')
+        self.assertEqual(list(limiter._key_calls), ['next'])
+
+
+if __name__ == '__main__':
+    unittest.main()